@@ -0,0 +1,50 @@
+"""
+Command line entry point.
+
+    python -m pydex build releases.jsonl --jobs 8 --output-dir ./out
+
+builds one message per release of a manifest (see manifest) and prints a
+throughput summary.
+"""
+import argparse
+import sys
+
+#  local imports
+from pydex.config import CACHE_DIR, TEST_XML_DIR
+from pydex.manifest import build_manifest
+
+
+def build(args) -> int:
+    summary = build_manifest(args.manifest,
+                             output_dir=args.output_dir,
+                             prefix=args.prefix,
+                             jobs=args.jobs,
+                             deterministic=args.deterministic,
+                             pretty_print=args.pretty_print,
+                             cache_dir=args.cache_dir or None)
+    for failure in summary.failures:
+        print(f"FAILED {failure.output_filename}: {failure.error}", file=sys.stderr)
+    print(summary)
+    return 1 if summary.failures else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='pydex', description='Build DDEX ERN messages.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='Build one message per release of a JSONL or CSV manifest.')
+    build_parser.add_argument('manifest')
+    build_parser.add_argument('--jobs', '-j', type=int, default=None,
+                              help='Worker processes, one per CPU by default.')
+    build_parser.add_argument('--output-dir', '-o', default=TEST_XML_DIR)
+    build_parser.add_argument('--prefix', default='message')
+    build_parser.add_argument('--cache-dir', default=CACHE_DIR,
+                              help='Probe cache directory, empty to disable it.')
+    build_parser.add_argument('--deterministic', action='store_true')
+    build_parser.add_argument('--pretty-print', action='store_true')
+    build_parser.set_defaults(run=build)
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
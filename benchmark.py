@@ -0,0 +1,330 @@
+"""
+Reproducible benchmarks over synthetic catalogs.
+
+Generates WAV, MP3-like and JPEG fixtures locally, builds a catalog of N
+tracks with M artists and K contributors per track and measures each
+builder, along with the memory the builder objects of a track retain.
+Results are written as JSON so runs can be compared between commits.
+
+    python -m pydex.benchmark --tracks 1000 --parties 2 --contributors 3
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import wave
+from uuid import uuid4 as uuid
+
+from lxml import etree as et
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.config import BENCH_DIR
+from pydex.tags import (MessageControlType,
+                        MessagePartyType,
+                        ParentalWarningType,
+                        PartyType,
+                        SoundRecordingType,
+                        TechnicalDetailsType,
+                        ImageType)
+from pydex.messageheader import MessageHeader, MessageParty
+from pydex.party import Party
+from pydex.resource_builder import (ResourceList,
+                                    SoundRecording,
+                                    TechnicalDetails,
+                                    ImageRl)
+
+logger = get_logger(__name__)
+
+SENDER_ID = 'PADPIDA0000000000B'
+
+
+def write_wav(path, seconds=1, sample_rate=44100, channels=2):
+    """Writes a silent 16 bit PCM wav file."""
+    with wave.open(str(path), 'wb') as audio:
+        audio.setnchannels(channels)
+        audio.setsampwidth(2)
+        audio.setframerate(sample_rate)
+        audio.writeframes(b'\x00\x00' * channels * sample_rate * seconds)
+
+
+def write_mp3(path, frames=200):
+    """Writes silent MPEG 1 layer III frames at 128kbps, 44.1kHz, joint stereo."""
+    frame = b'\xff\xfb\x90\x44' + b'\x00' * 413
+    with open(path, 'wb') as audio:
+        audio.write(frame * frames)
+
+
+def write_jpeg(path, size=(640, 640)):
+    """Writes a solid colour RGB jpeg."""
+    from PIL import Image
+    Image.new('RGB', size, (200, 30, 30)).save(path, 'JPEG')
+
+
+def make_catalog(directory, tracks, parties=1, contributors=1, audio_format='wav'):
+    """
+    Writes the fixtures of a synthetic catalog into directory and returns a
+    dict with the audio files, the cover file and the track metadata.
+    Artist and contributor names repeat across tracks like they do in real
+    catalogs.
+    """
+    os.makedirs(directory, exist_ok=True)
+    cover = os.path.join(directory, 'cover.jpg')
+    write_jpeg(cover)
+    files = []
+    for i in range(tracks):
+        path = os.path.join(directory, f'track{i:06d}.{audio_format}')
+        if audio_format == 'wav':
+            write_wav(path)
+        else:
+            write_mp3(path)
+        files.append(path)
+    metadata = [
+            {
+                'isrc': f'QZ{i // 100000:03d}23{i % 100000:05d}',
+                'song_name': f'Song {i}',
+                'artist_name': f'Artist {i % max(parties, 1)}',
+                'artists': [f'Artist {(i + j) % (parties * 4 or 1)}' for j in range(parties)],
+                'contributors': [f'Contributor {(i + j) % (contributors * 4 or 1)}' for j in range(contributors)],
+            }
+            for i in range(tracks)
+            ]
+    return {'files': files, 'cover': cover, 'metadata': metadata}
+
+
+def peak_rss():
+    """Return the peak resident set size of this process in bytes."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #  Linux reports kilobytes, macOS bytes.
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def measure(name, count, work):
+    """Run work() once and return its measurements for count items."""
+    start = time.perf_counter()
+    output_bytes = work()
+    seconds = time.perf_counter() - start
+    logger.info('%s: %s items in %.3fs', name, count, seconds)
+    return {
+            'items': count,
+            'seconds': seconds,
+            'items_per_second': count / seconds if seconds else None,
+            'seconds_per_item': seconds / count if count else None,
+            'output_bytes': output_bytes,
+            }
+
+
+def measure_memory(catalog):
+    """
+    Return the bytes retained by the builder objects of every track of
+    catalog (TechnicalDetails, Party and SoundRecording), as traced by
+    tracemalloc.
+    """
+    tracks = len(catalog['files'])
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        recordings = [
+                SoundRecording(type_=SoundRecordingType.musical_work_sound_recording.value,
+                               id_=track['isrc'],
+                               song_name=track['song_name'],
+                               artist_name=track['artist_name'],
+                               pline_text='2023 Record Label',
+                               parental_warning_type=ParentalWarningType.non_explicit.value,
+                               technical_details=TechnicalDetails(type_=TechnicalDetailsType.audio.value,
+                                                                  file=path,
+                                                                  resource_uuid=str(uuid()),
+                                                                  sender_id=SENDER_ID),
+                               party=[Party(PartyType.artist.value, name) for name in track['artists']],
+                               contributor=[Party(PartyType.contributor.value, name)
+                                            for name in track['contributors']])
+                for track, path in zip(catalog['metadata'], catalog['files'])
+                ]
+        #  Collect the garbage cycles left behind by probing, which are not retained.
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del recordings
+    logger.info('Memory: %s bytes for %s tracks', retained, tracks)
+    return {
+            'tracks': tracks,
+            'bytes': retained,
+            'bytes_per_track': retained / tracks if tracks else None,
+            }
+
+
+def measure_import_time(module='pydex.resource_builder'):
+    """
+    Import module in a fresh interpreter with -X importtime and return the
+    cumulative import time of module and its slowest dependencies.
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, check=True).stderr
+    #  import time: self [us] | cumulative | imported package
+    cumulative = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, total, name = line[len('import time:'):].split('|')
+        if total.strip().isdigit():
+            cumulative[name.strip()] = int(total) / 1e6
+    slowest = sorted(((name, seconds) for name, seconds in cumulative.items() if name != module),
+                     key=lambda item: item[1], reverse=True)[:10]
+    logger.info('Import of %s: %.3fs', module, cumulative[module])
+    return {
+            'module': module,
+            'seconds': cumulative[module],
+            'slowest': dict(slowest),
+            }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(tracks=100, parties=2, contributors=3, audio_format='wav',
+                  workdir=None, output_dir=BENCH_DIR):
+    """
+    Builds a synthetic catalog and measures every builder on it.
+    Returns the results and writes them as JSON into output_dir.
+    """
+    with tempfile.TemporaryDirectory(dir=workdir) as directory:
+        catalog = make_catalog(directory, tracks, parties, contributors, audio_format)
+        results = {}
+
+        sender = MessageParty(party_id=SENDER_ID, full_name='Sender',
+                              role=MessagePartyType.sender.value)
+        receiver = MessageParty(party_id='PADPIDA0000000000R', full_name='Receiver',
+                                role=MessagePartyType.receiver.value)
+
+        def build_headers():
+            return sum(len(et.tostring(MessageHeader(sender, receiver,
+                                                     MessageControlType.live.value).write()))
+                       for _ in range(tracks))
+        results['MessageHeader'] = measure('MessageHeader', tracks, build_headers)
+
+        party_objects = [
+                ([Party(PartyType.artist.value, name) for name in track['artists']],
+                 [Party(PartyType.contributor.value, name) for name in track['contributors']])
+                for track in catalog['metadata']
+                ]
+
+        def build_parties():
+            return sum(len(et.tostring(party.write()))
+                       for artists, track_contributors in party_objects
+                       for party in artists + track_contributors)
+        results['Party'] = measure('Party', tracks * (parties + contributors), build_parties)
+
+        technical_details = []
+
+        def build_technical_details():
+            technical_details.extend(
+                    TechnicalDetails(type_=TechnicalDetailsType.audio.value,
+                                     file=path,
+                                     resource_uuid=str(uuid()),
+                                     sender_id=SENDER_ID)
+                    for path in catalog['files'])
+            return sum(len(et.tostring(details.write())) for details in technical_details)
+        results['TechnicalDetails'] = measure('TechnicalDetails', tracks, build_technical_details)
+
+        recordings = [
+                SoundRecording(type_=SoundRecordingType.musical_work_sound_recording.value,
+                               id_=track['isrc'],
+                               song_name=track['song_name'],
+                               artist_name=track['artist_name'],
+                               pline_text='2023 Record Label',
+                               parental_warning_type=ParentalWarningType.non_explicit.value,
+                               technical_details=details,
+                               party=artists,
+                               contributor=track_contributors)
+                for track, details, (artists, track_contributors)
+                in zip(catalog['metadata'], technical_details, party_objects)
+                ]
+
+        def build_sound_recordings():
+            return sum(len(et.tostring(recording.write())) for recording in recordings)
+        results['SoundRecording'] = measure('SoundRecording', tracks, build_sound_recordings)
+
+        image = ImageRl(resource_reference='A0',
+                        id_value='0',
+                        type_=ImageType.front_cover_image.value,
+                        sender_id=SENDER_ID,
+                        technical_details=TechnicalDetails(type_=TechnicalDetailsType.image.value,
+                                                           file=catalog['cover'],
+                                                           resource_uuid=str(uuid())))
+
+        def build_resource_list():
+            return len(et.tostring(ResourceList(recordings, image).write(), pretty_print=True))
+        results['ResourceList'] = measure('ResourceList', tracks, build_resource_list)
+        memory = measure_memory(catalog)
+    import_time = measure_import_time()
+
+    report = {
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'parameters': {'tracks': tracks,
+                           'parties': parties,
+                           'contributors': contributors,
+                           'audio_format': audio_format},
+            'results': results,
+            'memory': memory,
+            #  Process wide and never lower, so only meaningful for the whole run.
+            'peak_rss': peak_rss(),
+            'import_time': import_time,
+            }
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        name = f"bench-{(report['revision'] or 'unknown')[:12]}-{tracks}.json"
+        report['output_file'] = os.path.join(output_dir, name)
+        with open(report['output_file'], 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    return report
+
+
+def format_rate(value, scale, spec='.1f') -> str:
+    """Format value * scale, or n/a for the rates of an empty run, which are None."""
+    return 'n/a' if value is None else format(value * scale, spec)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark pydex builders on a synthetic catalog.')
+    parser.add_argument('--tracks', type=int, default=100)
+    parser.add_argument('--parties', type=int, default=2)
+    parser.add_argument('--contributors', type=int, default=3)
+    parser.add_argument('--audio-format', choices=['wav', 'mp3'], default='wav')
+    parser.add_argument('--output-dir', default=BENCH_DIR,
+                        help='Directory of the JSON report, empty to not write it.')
+    args = parser.parse_args(argv)
+    report = run_benchmark(tracks=args.tracks,
+                           parties=args.parties,
+                           contributors=args.contributors,
+                           audio_format=args.audio_format,
+                           output_dir=args.output_dir or None)
+    for name, result in report['results'].items():
+        print(f"{name:<18} {format_rate(result['items_per_second'], 1):>12} items/s "
+              f"{format_rate(result['seconds_per_item'], 1000, '.3f'):>9} ms/item "
+              f"{result['output_bytes']:>12} bytes")
+    print(f"{'Memory':<18} {format_rate(report['memory']['bytes_per_track'], 1):>12} bytes/track")
+    print(f"{'Import':<18} {report['import_time']['seconds'] * 1000:>12.1f} ms")
+    if 'output_file' in report:
+        print(f"Results written to {report['output_file']}")
+
+if __name__ == "__main__":
+    main()
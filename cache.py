@@ -0,0 +1,281 @@
+"""
+Persistent on-disk caches of probe results and XML fragments.
+
+Probing a file means parsing its headers and hashing all of its bytes,
+which dominates the time of a build. Most masters do not change between
+deliveries, so results are stored in a SQLite database and reused as long
+as the file's identity (path, size, mtime and inode) is unchanged.
+
+Likewise most tracks of a release do not change between update messages,
+so the serialized SoundRecording, TechnicalDetails and Image fragments are
+stored keyed by a fingerprint of their inputs and spliced back unchanged.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from lxml import etree as et
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.config import (CACHE_DIR,
+                          CACHE_MAX_ENTRIES,
+                          CACHE_MAX_BYTES,
+                          CACHE_RESYNC_INTERVAL,
+                          PROBE_CACHE_VERSION,
+                          FRAGMENT_FORMAT_VERSION)
+from pydex.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class SQLiteCache:
+    """
+    Base of the SQLite backed caches: a table with payload and last_access
+    columns whose rows are evicted least recently used first once it holds
+    more than max_entries rows or more than max_bytes of payload.
+
+    The row count and payload size are kept as running totals, read from
+    the table once when it is opened and updated by every put and eviction,
+    so a put does not scan the table. Other processes sharing the database
+    change it behind our back, the totals are read again every
+    CACHE_RESYNC_INTERVAL puts to catch up with them.
+    """
+    table = None
+    key_columns = ()
+
+    def __init__(self, path: str, max_entries: int, max_bytes: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.create_table()
+            self.connection.execute(
+                    f'CREATE INDEX IF NOT EXISTS {self.table}_last_access ON {self.table} (last_access)'
+                    )
+        self.resync()
+        logger.debug('Opened %s cache at %s', self.table, self.path)
+
+    def create_table(self):
+        raise NotImplementedError
+
+    def resync(self):
+        """Read the running totals from the table."""
+        self.count, self.total = self.connection.execute(
+                f'SELECT COUNT(*), COALESCE(SUM(LENGTH(payload)), 0) FROM {self.table}'
+                ).fetchone()
+
+    def store(self, row: dict):
+        """
+        Insert or replace row, a dict of column values, and evict entries
+        if the cache outgrew its limits. Call with self.lock held.
+        """
+        key = tuple(row[column] for column in self.key_columns)
+        where = ' AND '.join(f'{column} = ?' for column in self.key_columns)
+        with self.connection:
+            old = self.connection.execute(
+                    f'SELECT LENGTH(payload) FROM {self.table} WHERE {where}', key
+                    ).fetchone()
+            self.connection.execute(
+                    f'INSERT OR REPLACE INTO {self.table} ({", ".join(row)})'
+                    f' VALUES ({", ".join("?" for _ in row)})',
+                    tuple(row.values()),
+                    )
+            if old is None:
+                self.count += 1
+            else:
+                self.total -= old[0]
+            self.total += len(row['payload'])
+            self.puts += 1
+            if self.puts % CACHE_RESYNC_INTERVAL == 0:
+                self.resync()
+            if self.count > self.max_entries or (self.max_bytes and self.total > self.max_bytes):
+                self.evict()
+
+    def evict(self):
+        """Drop least recently used entries until the cache is within its limits."""
+        excess_entries = self.count - self.max_entries
+        excess_bytes = self.total - self.max_bytes if self.max_bytes else 0
+        rowids = []
+        rows = self.connection.execute(f'SELECT rowid, LENGTH(payload) FROM {self.table} ORDER BY last_access')
+        for rowid, length in rows:
+            if excess_entries <= 0 and excess_bytes <= 0:
+                break
+            rowids.append((rowid,))
+            excess_entries -= 1
+            excess_bytes -= length
+            self.count -= 1
+            self.total -= length
+        rows.close()
+        if rowids:
+            logger.debug('Evicting %s entries from %s cache', len(rowids), self.table)
+            self.connection.executemany(f'DELETE FROM {self.table} WHERE rowid = ?', rowids)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+
+class ProbeCache(SQLiteCache):
+    """
+    SQLite backed cache of probe results keyed by file identity.
+
+    Every row records the PROBE_CACHE_VERSION it was written with, rows of
+    any other version are misses and are overwritten on the next put.
+    """
+    table = 'probe'
+    key_columns = ('path', 'kind')
+
+    def __init__(self,
+                 cache_dir: str = CACHE_DIR,
+                 max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES,
+                 version: int = PROBE_CACHE_VERSION,
+                 ):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.version = version
+        super().__init__(os.path.join(cache_dir, 'probe.sqlite3'), max_entries, max_bytes)
+
+    def create_table(self):
+        self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS probe ('
+                ' path TEXT NOT NULL,'
+                ' kind TEXT NOT NULL,'
+                ' size INTEGER NOT NULL,'
+                ' mtime_ns INTEGER NOT NULL,'
+                ' inode INTEGER NOT NULL,'
+                ' payload TEXT NOT NULL,'
+                ' last_access REAL NOT NULL,'
+                ' version INTEGER NOT NULL DEFAULT 0,'
+                ' PRIMARY KEY (path, kind))'
+                )
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(probe)')]
+        if 'version' not in columns:
+            #  Caches written before rows were versioned, all of their
+            #  rows become misses.
+            self.connection.execute('ALTER TABLE probe ADD COLUMN version INTEGER NOT NULL DEFAULT 0')
+
+    @staticmethod
+    def identity(file: str):
+        """Return the (path, size, mtime_ns, inode) identity of file."""
+        stat = os.stat(file)
+        return os.path.abspath(file), stat.st_size, stat.st_mtime_ns, stat.st_ino
+
+    def get(self, kind: str, file: str):
+        """
+        Return the cached payload dict of kind for file, or None if there is
+        no entry, the file changed since it was stored or the entry was
+        written with another version.
+        """
+        path, size, mtime_ns, inode = self.identity(file)
+        with self.lock:
+            row = self.connection.execute(
+                    'SELECT payload FROM probe WHERE path = ? AND kind = ?'
+                    ' AND size = ? AND mtime_ns = ? AND inode = ? AND version = ?',
+                    (path, kind, size, mtime_ns, inode, self.version),
+                    ).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.incr('cache.miss', kind=kind, file=file)
+                return None
+            self.hits += 1
+            metrics.incr('cache.hit', kind=kind, file=file)
+            with self.connection:
+                self.connection.execute(
+                        'UPDATE probe SET last_access = ? WHERE path = ? AND kind = ?',
+                        (time.time(), path, kind),
+                        )
+        return json.loads(row[0])
+
+    def put(self, kind: str, file: str, payload: dict):
+        """Store payload of kind for the current identity of file."""
+        path, size, mtime_ns, inode = self.identity(file)
+        with self.lock:
+            self.store({'path': path, 'kind': kind, 'size': size, 'mtime_ns': mtime_ns, 'inode': inode,
+                        'payload': json.dumps(payload), 'last_access': time.time(), 'version': self.version})
+
+
+class FragmentCache(SQLiteCache):
+    """
+    SQLite backed cache of serialized XML fragments keyed by fingerprint.
+
+    Anything with fingerprint() and write() methods can be cached, namely
+    SoundRecording, TechnicalDetails and ImageRl. Fingerprints cover the
+    references a fragment writes, so fragments only hit across builds when
+    those are stable, i.e. in deterministic mode. Keys also carry
+    FRAGMENT_FORMAT_VERSION, so fragments serialized by an older pydex are
+    never spliced into new messages.
+    """
+    table = 'fragment'
+    key_columns = ('kind', 'key')
+
+    def __init__(self,
+                 cache_dir: str = CACHE_DIR,
+                 max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES,
+                 version: int = FRAGMENT_FORMAT_VERSION,
+                 ):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.version = version
+        super().__init__(os.path.join(cache_dir, 'fragment.sqlite3'), max_entries, max_bytes)
+
+    def create_table(self):
+        self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS fragment ('
+                ' kind TEXT NOT NULL,'
+                ' key TEXT NOT NULL,'
+                ' payload BLOB NOT NULL,'
+                ' last_access REAL NOT NULL,'
+                ' PRIMARY KEY (kind, key))'
+                )
+
+    def get(self, kind: str, key: str):
+        """Return the cached bytes of kind for key, or None."""
+        with self.lock:
+            row = self.connection.execute(
+                    'SELECT payload FROM fragment WHERE kind = ? AND key = ?',
+                    (kind, key),
+                    ).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.incr('fragment.miss', kind=kind)
+                return None
+            self.hits += 1
+            metrics.incr('fragment.hit', kind=kind)
+            with self.connection:
+                self.connection.execute(
+                        'UPDATE fragment SET last_access = ? WHERE kind = ? AND key = ?',
+                        (time.time(), kind, key),
+                        )
+        return bytes(row[0])
+
+    def put(self, kind: str, key: str, payload: bytes):
+        """Store the serialized fragment payload of kind under key."""
+        with self.lock:
+            self.store({'kind': kind, 'key': key, 'payload': payload, 'last_access': time.time()})
+
+    def build(self, fragment, *args) -> et.Element:
+        """
+        Return the element of fragment, parsed from the cache if its
+        fingerprint is known, otherwise built with fragment.write(*args)
+        and stored.
+        """
+        kind = type(fragment).__name__
+        key = f'{self.version}:{fragment.fingerprint()}'
+        payload = self.get(kind, key)
+        if payload is not None:
+            return et.fromstring(payload)
+        tag = fragment.write(*args)
+        self.put(kind, key, et.tostring(tag, encoding='utf-8'))
+        return tag
@@ -3,3 +3,44 @@ import os
 LOG_DIR = './docs/logs'
 TEST_XML_DIR = './docs/xml'
 FIXTURES_DIR = './docs/fixtures'
+CACHE_DIR = './docs/cache'
+CACHE_MAX_ENTRIES = 200_000
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+#  Puts between re-reading the size of a cache shared with other processes.
+CACHE_RESYNC_INTERVAL = 1000
+#  Layout of the probe results stored in ProbeCache. Bump it whenever
+#  AudioProbe, ImageProbe or the meaning of their values change.
+PROBE_CACHE_VERSION = 2
+#  Serialized form of the fragments stored in FragmentCache. Bump it
+#  whenever templates, namespaces or element order of a fragment change.
+FRAGMENT_FORMAT_VERSION = 1
+HASH_ALGORITHMS = ('md5',)
+HASH_BUFFER_SIZE = 4 * 1024 * 1024
+PIPELINE_QUEUE_SIZE = 8
+PIPELINE_PROBE_CONCURRENCY = 8
+PIPELINE_BUILD_CONCURRENCY = 2
+PIPELINE_SERIALIZE_CONCURRENCY = 2
+PIPELINE_WRITE_CONCURRENCY = 4
+LOG_LEVEL = 'WARNING'
+LOG_FILE = 'ddex'
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+BENCH_DIR = './docs/bench'
+#  Seconds a fresh interpreter may spend importing pydex.resource_builder.
+IMPORT_TIME_BUDGET = 0.25
+#  Namespace of the uuid5 references handed out in deterministic mode.
+ID_NAMESPACE = '6f1d3c2e-8a4b-5e7f-9c0d-2b3a4f5e6d7c'
+#  Joins the names of a multi-valued column (artists, contributors) in tabular input.
+TABLE_LIST_SEPARATOR = '|'
+SHARD_MAX_TRACKS = 5000
+SHARD_MAX_BYTES = None
+#  Rough serialized size of a sound recording's markup, before its text.
+SHARD_TRACK_BYTES = 1200
+SINK_BUFFER_SIZE = 1024 * 1024
+SINK_COMPRESSION_LEVEL = 6
+SCHEMA_DIR = './docs/schema'
+SCHEMA_FILE = 'release-notification.xsd'
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8765
+SERVER_WORKERS = os.cpu_count() or 1
+SERVER_MAX_PENDING = 64
+SERVER_TIMEOUT = 60
@@ -0,0 +1,138 @@
+"""
+Structural diff of two ERN messages.
+
+Every resource pydex emits is reduced to a Merkle-style hash of its
+subtree: a SoundRecording's digest covers its own canonical form and the
+digest of its TechnicalDetails, so a changed recording tells whether its
+file changed too. Formatting does not matter and equal subtrees hash
+equally. Both messages are streamed once with iterparse, resources are
+matched by ISRC, ResourceReference or PartyReference, and only the
+digests are compared, which keeps the diff linear in the size of the
+messages and its memory in the number of resources.
+"""
+import hashlib
+from typing import List, NamedTuple
+
+from lxml import etree as et
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.tags import (PartyListTags,
+                        ResourceListTags,
+                        SoundRecordingTags,
+                        TechnicalDetailsTags,
+                        ImageTags)
+from pydex.metrics import metrics
+
+logger = get_logger(__name__)
+
+SOUND_RECORDING = ResourceListTags.sound_recording.value
+TECHNICAL_DETAILS = TechnicalDetailsTags.root.value
+IMAGE = ImageTags.root.value
+PARTY = PartyListTags.party.value
+RESOURCE_TAGS = frozenset((SOUND_RECORDING, IMAGE, PARTY))
+ISRC = f"{SoundRecordingTags.resource_id.value}/{SoundRecordingTags.isrc.value}"
+
+
+class Change(NamedTuple):
+    """A resource that differs, e.g. Change('SoundRecording', 'QZABC2300001')."""
+    kind: str
+    key: str
+
+
+class MessageDiff(NamedTuple):
+    added: List[Change]
+    removed: List[Change]
+    changed: List[Change]
+    unchanged: int
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        lines = [f"{sign} {change.kind} {change.key}"
+                 for sign, changes in (('+', self.added), ('-', self.removed), ('~', self.changed))
+                 for change in changes]
+        return '\n'.join(lines + [f"{self.unchanged} unchanged"])
+
+
+def subtree_hash(element, ignore=frozenset(), children=()):
+    """
+    Return the digest of element and its subtree, hashed from its canonical
+    (C14N) form so that attribute order does not matter. Elements whose tag
+    is in ignore are left out.
+
+    Children listed in children are detached and hashed on their own, and
+    their digests feed into the digest of element, Merkle style. Returns
+    (digest, {tag: child digest}) in that case.
+    """
+    for tag in ignore:
+        for child in list(element.iter(tag)):
+            child.getparent().remove(child)
+    child_digests = {}
+    for tag in children:
+        child = element.find(tag)
+        if child is not None:
+            child_digests[tag] = subtree_hash(child)
+            element.remove(child)
+    hasher = hashlib.blake2b(et.tostring(element, method='c14n'), digest_size=16)
+    for tag in children:
+        hasher.update(child_digests.get(tag, b''))
+    if children:
+        return hasher.digest(), child_digests
+    return hasher.digest()
+
+
+def index_message(source, ignore=()) -> dict:
+    """
+    Stream the message in source, a path or binary file-like object, and
+    return {(kind, key): digest} for its sound recordings, their technical
+    details, images and PartyList parties.
+    """
+    ignore = frozenset(ignore)
+    index = {}
+    tags = [f'{{*}}{tag}' for tag in RESOURCE_TAGS]
+    #  Formatting whitespace is dropped while parsing, so pretty printed and
+    #  compact messages hash the same.
+    for _, element in et.iterparse(source, tag=tags, remove_comments=True, remove_blank_text=True):
+        tag = element.tag.rpartition('}')[2]
+        if any(ancestor.tag in RESOURCE_TAGS for ancestor in element.iterancestors()):
+            #  A Party written inline is part of its SoundRecording.
+            continue
+        if tag == SOUND_RECORDING:
+            key = element.findtext(ISRC) or element.findtext(SoundRecordingTags.resource_reference.value)
+            digest, children = subtree_hash(element, ignore, (TECHNICAL_DETAILS,))
+            index[(SOUND_RECORDING, key)] = digest
+            if TECHNICAL_DETAILS in children:
+                index[(TECHNICAL_DETAILS, key)] = children[TECHNICAL_DETAILS]
+        elif tag == IMAGE:
+            index[(IMAGE, element.findtext(ImageTags.resource_reference.value))] = subtree_hash(element, ignore)
+        else:
+            index[(PARTY, element.findtext(PartyListTags.party_reference.value))] = subtree_hash(element, ignore)
+        element.clear(keep_tail=True)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    return index
+
+
+def diff_messages(old, new, ignore=()) -> MessageDiff:
+    """
+    Compare the resources of the old and new messages, each a path, a
+    binary file-like object or an index from index_message.
+
+    Tags in ignore are left out of every hash, e.g.
+    TechnicalResourceDetailsReference when references are not
+    deterministic.
+    """
+    with metrics.span('diff'):
+        old_index = old if isinstance(old, dict) else index_message(old, ignore)
+        new_index = new if isinstance(new, dict) else index_message(new, ignore)
+        added = [Change(*key) for key in new_index if key not in old_index]
+        removed = [Change(*key) for key in old_index if key not in new_index]
+        changed = [Change(*key) for key, digest in new_index.items()
+                   if key in old_index and old_index[key] != digest]
+    unchanged = len(new_index) - len(added) - len(changed)
+    logger.info('Diff: %s added, %s removed, %s changed, %s unchanged.',
+                len(added), len(removed), len(changed), unchanged)
+    return MessageDiff(added, removed, changed, unchanged)
@@ -1,15 +1,9 @@
 """
 Collection of all custom error classes.
 """
-import sys
-from pathlib import Path
-
-file = Path(__file__).resolve()
-package_root_directory = file.parents[1]
-sys.path.append(str(package_root_directory))
-
 from pydex.tags import MessagePartyTags
 
+
 class InvalidTypeError(Exception):
     """
     Error class for invalid type.
@@ -43,3 +37,42 @@ class MissingAttribute(Exception):
     def __init__(self, codec_type):
         self.codec_type = codec_type
         self.message = f"Missing a required attribute sender_id for codec type {self.codec_type}"
+
+
+class ProbeError(Exception):
+    """
+    Error class for a resource file that could not be probed.
+    Batch APIs return it in place of the result instead of raising, so one
+    bad file does not stop the others.
+    """
+    def __init__(self, file, error):
+        self.file = file
+        self.error = error
+        self.message = f"Could not probe {self.file}: {self.error!r}"
+        super().__init__(self.file, self.error)
+
+    def __str__(self):
+        return self.message
+
+
+class ValidationError(Exception):
+    """
+    Error class for release input that failed pre-flight validation.
+    Carries the full ValidationReport so every problem is reported at once.
+    """
+    def __init__(self, report):
+        self.report = report
+        self.message = f"Release input has {len(report.problems)} problem(s):\n{report}"
+        super().__init__(self.message)
+
+
+class SchemaValidationError(Exception):
+    """
+    Error class for a message that does not conform to the XML schema.
+    Carries every SchemaProblem lxml reported.
+    """
+    def __init__(self, problems):
+        self.problems = problems
+        self.message = f"Message has {len(problems)} schema problem(s):\n" \
+                + '\n'.join(str(problem) for problem in problems)
+        super().__init__(self.message)
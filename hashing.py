@@ -0,0 +1,57 @@
+"""
+Hashing engine shared by every resource type.
+
+Each file is read exactly once, with a large reusable buffer, and every
+requested digest is updated from the same buffer. hashlib releases the GIL
+while digesting, so hash_files can hash many files in parallel threads.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.config import HASH_ALGORITHMS, HASH_BUFFER_SIZE
+from pydex.exceptions import ProbeError
+from pydex.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+def hash_file(file: str,
+              algorithms=HASH_ALGORITHMS,
+              buffer_size: int = HASH_BUFFER_SIZE) -> dict:
+    """
+    Return a dict mapping each algorithm name to the hexdigest of file,
+    computed in a single pass over its bytes.
+    """
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    total = 0
+    with metrics.span('hash', file=file), open(file, 'rb', buffering=0) as data:
+        while size := data.readinto(buffer):
+            chunk = view[:size]
+            for hasher in hashers.values():
+                hasher.update(chunk)
+            total += size
+    metrics.incr('hash.bytes', total, file=file)
+    digests = {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+    logger.debug('Hashed %s: %s', file, digests)
+    return digests
+
+
+def hash_files(files, algorithms=HASH_ALGORITHMS, workers=None) -> list:
+    """
+    Hash many files in a thread pool.
+    Results are returned in the order of files; a file that could not be
+    read gets a ProbeError in its slot instead of a digest dict.
+    """
+    def hash_one(file):
+        try:
+            return hash_file(file, algorithms)
+        except OSError as error:
+            logger.error('Failed to hash %s: %r', file, error)
+            return ProbeError(file, error)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(hash_one, files))
@@ -0,0 +1,244 @@
+"""
+Batch builds of release manifests.
+
+A manifest lists the releases of a delivery, one message per release, and
+is read one row at a time so that catalogs of any size fit in memory:
+
+* JSONL: one release description (see validation) per line.
+* CSV: one sound recording per row, with the columns of a table (see
+  table) plus the release columns in RELEASE_COLUMNS. Consecutive rows
+  with the same release value make up one release.
+
+build_manifest validates every release as it is read and builds the valid
+ones in a pool of worker processes, writing <prefix>-<index>.xml into the
+output directory. It is what `python -m pydex build` runs.
+"""
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, NamedTuple
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.config import CACHE_DIR, TEST_XML_DIR
+from pydex.tags import MessageControlType
+from pydex.cache import ProbeCache
+from pydex.exceptions import ValidationError
+from pydex.metrics import metrics
+from pydex.pipeline import BuildResult
+from pydex.release import build_message
+from pydex.sinks import Sink
+from pydex.table import LIST_COLUMNS, OPTIONAL_COLUMNS, split_names
+from pydex.validation import ValidationReport, Validator
+
+logger = get_logger(__name__)
+
+#  CSV columns describing the release a row belongs to, mapped to their
+#  place in the release description.
+RELEASE_COLUMNS = {
+        'sender_id': ('sender', 'party_id'),
+        'sender_name': ('sender', 'full_name'),
+        'receiver_id': ('receiver', 'party_id'),
+        'receiver_name': ('receiver', 'full_name'),
+        'image_file': ('image', 'file'),
+        'image_type': ('image', 'type'),
+        'image_reference': ('image', 'resource_reference'),
+        'image_id': ('image', 'id_value'),
+        }
+RELEASE_KEY = 'release'
+
+#  Set in every worker process by init_worker.
+worker_cache = None
+
+
+class ManifestSummary(NamedTuple):
+    """
+    Totals of a manifest build. bytes_read counts the resource files of
+    the built messages, failures holds the BuildResult of every release
+    that was not built.
+    """
+    messages: int
+    tracks: int
+    bytes_read: int
+    bytes_written: int
+    seconds: float
+    failures: List[BuildResult]
+
+    @property
+    def messages_per_second(self) -> float:
+        return self.messages / self.seconds if self.seconds else 0.0
+
+    @property
+    def tracks_per_second(self) -> float:
+        return self.tracks / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"Built {self.messages} messages ({self.tracks} tracks) in {self.seconds:.2f} s, "
+                f"{len(self.failures)} failed\n"
+                f"{self.messages_per_second:.1f} messages/s, {self.tracks_per_second:.1f} tracks/s\n"
+                f"{self.bytes_read} bytes read, {self.bytes_written} bytes written")
+
+
+def read_manifest(source):
+    """
+    Yield the release descriptions of the manifest at source, a .jsonl or
+    .csv path, one at a time. Raises ValueError on a line that is not JSON.
+    """
+    for _, release in iter_manifest(source):
+        if isinstance(release, ManifestLineError):
+            raise release
+        yield release
+
+
+class ManifestLineError(ValueError):
+    """A manifest line that could not be decoded, yielded by iter_manifest in place of its release."""
+
+
+def iter_manifest(source):
+    """
+    Yield (line, release) for every release of the manifest at source,
+    where line is the line number the release starts at. A line that
+    cannot be decoded yields a ManifestLineError instead of a release, so
+    that one bad line does not end the manifest.
+    """
+    if str(source).endswith('.csv'):
+        yield from iter_csv_manifest(source)
+        return
+    with open(source, encoding='utf-8') as lines:
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as error:
+                    yield number, ManifestLineError(f'{source}:{number}: {error}')
+
+
+def iter_csv_manifest(source):
+    with open(source, newline='', encoding='utf-8') as data:
+        rows = csv.DictReader(data)
+        numbered = ((rows.line_num, row) for row in rows)
+        for _, group in itertools.groupby(numbered, key=lambda item: item[1].get(RELEASE_KEY)):
+            group = list(group)
+            yield group[0][0], release_from_rows(row for _, row in group)
+
+
+def release_from_rows(rows) -> dict:
+    """Return the release description of the CSV rows of one release."""
+    release = {}
+    tracks = []
+    for row in rows:
+        if not release:
+            for column, (part, field) in RELEASE_COLUMNS.items():
+                release.setdefault(part, {})[field] = row.get(column)
+            release['message_control_type'] = (row.get('message_control_type')
+                                               or MessageControlType.live.value)
+        track = {name: value for name, value in row.items()
+                 if name not in RELEASE_COLUMNS and name not in (RELEASE_KEY, 'message_control_type')}
+        for name in LIST_COLUMNS:
+            if name in track:
+                track[name], = split_names([track[name] or ''])
+        for name in OPTIONAL_COLUMNS:
+            if name in track and track[name] in ('', None):
+                track[name] = None
+        tracks.append(track)
+    release['sound_recordings'] = tracks
+    return release
+
+
+def init_worker(cache_dir):
+    global worker_cache
+    worker_cache = ProbeCache(cache_dir) if cache_dir else None
+
+
+def release_files(release: dict) -> list:
+    return [track['file'] for track in release['sound_recordings']] + [release['image']['file']]
+
+
+def build_release(release: dict, output_path: str, deterministic: bool, pretty_print: bool):
+    """
+    Build and write one release. Runs in a worker process.
+    Returns the BuildResult and the number of resource bytes read.
+    """
+    try:
+        root = build_message(release, deterministic=deterministic, cache=worker_cache)
+        Sink(output_path, pretty_print=pretty_print).write(root)
+        bytes_read = sum(os.path.getsize(path) for path in release_files(release))
+        return BuildResult(output_path, os.path.getsize(output_path), None), bytes_read
+    except Exception as error:
+        logger.error('Failed to build %s: %r', output_path, error)
+        return BuildResult(output_path, None, error), 0
+
+
+def build_manifest(source,
+                   output_dir: str = TEST_XML_DIR,
+                   prefix: str = 'message',
+                   jobs: int = None,
+                   deterministic: bool = False,
+                   pretty_print: bool = False,
+                   cache_dir: str = CACHE_DIR,
+                   ) -> ManifestSummary:
+    """
+    Build one message per release of the manifest at source into
+    output_dir, in jobs worker processes.
+
+    At most twice as many releases as workers are read ahead, however long
+    the manifest is. Lines that cannot be decoded, invalid releases and
+    releases that fail to build are reported in the summary, located by
+    their line in the manifest, and do not stop the others.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    validator = Validator()
+    #  Shared by every release so that an ISRC is delivered only once.
+    seen_isrcs = {}
+    messages = tracks = bytes_read = bytes_written = 0
+    failures = []
+    pending = {}
+    start = time.perf_counter()
+
+    def collect(futures):
+        nonlocal messages, tracks, bytes_read, bytes_written
+        for future in futures:
+            output_path, count = pending.pop(future)
+            try:
+                result, read = future.result()
+            except Exception as error:
+                #  E.g. an error that could not be sent back from the worker.
+                logger.error('Failed to build %s: %r', output_path, error)
+                result, read = BuildResult(output_path, None, error), 0
+            if result.error is not None:
+                failures.append(result)
+                continue
+            messages += 1
+            tracks += count
+            bytes_read += read
+            bytes_written += result.size
+
+    with metrics.span('build.manifest', manifest=str(source)), \
+            ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(cache_dir,)) as executor:
+        for index, (line, release) in enumerate(iter_manifest(source)):
+            output_path = os.path.join(output_dir, f'{prefix}-{index:06d}.xml')
+            if isinstance(release, ManifestLineError):
+                logger.error('Skipping undecodable release: %s', release)
+                failures.append(BuildResult(output_path, None, release))
+                continue
+            report = ValidationReport()
+            validator.validate_release(release, f'{source}:{line}', report, seen_isrcs)
+            if not report.ok:
+                logger.error('Skipping invalid release at %s:%s:\n%s', source, line, report)
+                failures.append(BuildResult(output_path, None, ValidationError(report)))
+                continue
+            future = executor.submit(build_release, release, output_path, deterministic, pretty_print)
+            pending[future] = output_path, len(release['sound_recordings'])
+            if len(pending) >= 2 * jobs:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(list(pending))
+
+    summary = ManifestSummary(messages, tracks, bytes_read, bytes_written,
+                              time.perf_counter() - start, failures)
+    logger.info('Built %s messages from %s, %s failed.', messages, source, len(failures))
+    return summary
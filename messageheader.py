@@ -5,67 +5,88 @@ Github: https://iamu985.github.io
 
 Builds MessageHeader section of the xml document.
 """
-import sys
-from pathlib import Path
-
-file = Path(__file__).resolve()
-package_root_directory = file.parents[1]
-sys.path.append(str(package_root_directory))
 
 from lxml import etree as et
 from uuid import uuid4 as uuid
 from datetime import datetime
 
 # local imports
-from pydex.utils import get_logger, add_subelement_with_text
+from pydex.utils import get_logger, add_subelement_with_text, content_id
 from pydex.tags import (MessageHeaderTags,
                         MessageControlType,
                         MessagePartyTags,
                         MessagePartyType)
 from pydex.exceptions import InvalidPartyType
+from pydex.metrics import metrics
+from pydex.templates import ElementTemplate
+
+logger = get_logger(__name__)
 
-logger = get_logger(__name__, 'ddex')
+MESSAGE_PARTY_TEMPLATES = {
+        tag: ElementTemplate(tag,
+                             MessagePartyTags.party_id.value,
+                             (MessagePartyTags.party_name.value, MessagePartyTags.full_name.value))
+        for tag in (MessagePartyTags.sender.value, MessagePartyTags.receiver.value)
+        }
 
 
 class MessageHeader:
     """
     Builds MessageHeader tag
+
+    In deterministic mode live thread and message ids are derived from the
+    sender, the receiver and created_datetime instead of being random.
+    Pass created_datetime as well to get a byte-identical header.
+    thread_id and message_id override both, e.g. to give every shard of a
+    catalog the same MessageThreadId.
     """
+    __slots__ = ('sender', 'receiver', 'message_control_type', 'created_datetime',
+                 'thread_id', 'message_id')
 
     def __init__(self,
                  sender: et.Element,
                  receiver: et.Element,
                  message_control_type: MessageControlType = MessageControlType.live.value,
+                 created_datetime: datetime = None,
+                 deterministic: bool = False,
+                 thread_id: str = None,
+                 message_id: str = None,
                  ):
         self.sender = sender
         self.receiver = receiver
         self.message_control_type = message_control_type
+        self.created_datetime = created_datetime or datetime.now()
         if self.message_control_type == MessageControlType.test.value:
             self.thread_id = 'Test0'
             self.message_id = 'Test1'
+        elif deterministic:
+            parts = (sender.party_id, receiver.party_id, self.created_datetime.isoformat())
+            self.thread_id = content_id('MessageThreadId', *parts)
+            self.message_id = content_id('MessageId', *parts)
         else:
             self.thread_id = str(uuid())
             self.message_id = str(uuid())
-        self.created_datetime = datetime.now()
+        self.thread_id = thread_id or self.thread_id
+        self.message_id = message_id or self.message_id
 
     def get_formatted_datetime(self) -> str:
         if self.message_control_type == MessageControlType.test.value:
-            logger.debug('Is in test mode')
             logger.debug('Formatting datetime object.')
             return self.created_datetime.strftime("%Y-%m-%d")
         logger.debug('Formatting datetime object.')
         return self.created_datetime.strftime("%Y-%m-%dT%H:%M:%S")
 
     def write(self) -> et.Element:
-        logger.info("Writing MessageHeader section to xml document.")
-        tag: et.Element = et.Element(MessageHeaderTags.root.value)
-        add_subelement_with_text(tag, MessageHeaderTags.thread_id.value, self.thread_id)
-        add_subelement_with_text(tag, MessageHeaderTags.message_id.value, self.message_id)
-
-        tag.append(self.sender.write())
-        tag.append(self.receiver.write())
-        add_subelement_with_text(tag, MessageHeaderTags.message_created_date_time.value, self.get_formatted_datetime())
-        add_subelement_with_text(tag, MessageHeaderTags.message_control_type.value, self.message_control_type)
+        logger.debug("Writing MessageHeader section to xml document.")
+        with metrics.span('build.message_header', message=self.message_id):
+            tag: et.Element = et.Element(MessageHeaderTags.root.value)
+            add_subelement_with_text(tag, MessageHeaderTags.thread_id.value, self.thread_id)
+            add_subelement_with_text(tag, MessageHeaderTags.message_id.value, self.message_id)
+
+            tag.append(self.sender.write())
+            tag.append(self.receiver.write())
+            add_subelement_with_text(tag, MessageHeaderTags.message_created_date_time.value, self.get_formatted_datetime())
+            add_subelement_with_text(tag, MessageHeaderTags.message_control_type.value, self.message_control_type)
         return tag
 
 
@@ -73,6 +94,7 @@ class MessageParty:
     """
     Sender or Receiver Object
     """
+    __slots__ = ('party_id', 'full_name', 'role')
 
     def __init__(self,
                  party_id: str,
@@ -101,17 +123,4 @@ class MessageParty:
         return tag
 
     def write(self) -> et.Element:
-        tag = et.Element(self.assign_role())
-        add_subelement_with_text(tag, MessagePartyTags.party_id.value, self.party_id)
-        tag.append(self.build_party_name())
-        return tag
-
-
-if __name__ == "__main__":
-    from test.utils import get_messageheader_fixture
-    from utils import save
-    from config import TEST_XML_DIR
-
-    root = get_messageheader_fixture()
-    output_file = "messageheader_test.xml"
-    save(root.write(), output_file)
+        return MESSAGE_PARTY_TEMPLATES[self.assign_role()].fill(self.party_id, self.full_name)
@@ -0,0 +1,116 @@
+"""
+Timing and counter instrumentation for builds.
+
+The library records into the module level `metrics` object. Spans and
+counters are aggregated by name under a lock, which is cheap enough to
+leave on in production. Labels such as the file or message a value belongs
+to are passed to hooks, so a metrics system can keep the detail, and are
+only kept in memory if keep_spans is set.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+#  utils records into metrics, so this module cannot import from it.
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """
+    Collects timing spans and counters.
+
+    A hook is any callable taking (kind, name, value, labels), where kind
+    is 'span' (value in seconds) or 'counter'. Hooks are called for every
+    record, on the thread that recorded it. Values recorded in worker
+    processes stay in those processes.
+    """
+
+    def __init__(self, enabled: bool = True, keep_spans: bool = False):
+        self.enabled = enabled
+        self.keep_spans = keep_spans
+        self.lock = threading.Lock()
+        self.hooks = []
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            #  name -> [count, total seconds, max seconds]
+            self.timings = {}
+            self.counters = {}
+            self.spans = []
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    @contextmanager
+    def span(self, name: str, **labels):
+        """Time the body of a with block as a span called name."""
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, labels)
+
+    def record(self, name: str, seconds: float, labels: dict = None):
+        """Record a span that was timed elsewhere."""
+        if not self.enabled:
+            return
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                self.timings[name] = [1, seconds, seconds]
+            else:
+                timing[0] += 1
+                timing[1] += seconds
+                if seconds > timing[2]:
+                    timing[2] = seconds
+            if self.keep_spans:
+                self.spans.append({'name': name, 'seconds': seconds, **(labels or {})})
+        for hook in self.hooks:
+            hook('span', name, seconds, labels or {})
+
+    def incr(self, name: str, value=1, **labels):
+        """Add value to the counter called name."""
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+        for hook in self.hooks:
+            hook('counter', name, value, labels)
+
+    def snapshot(self) -> dict:
+        """Return the aggregated spans and counters as plain data."""
+        with self.lock:
+            snapshot = {
+                    'timings': {
+                        name: {'count': count, 'total': total, 'mean': total / count, 'max': maximum}
+                        for name, (count, total, maximum) in self.timings.items()
+                        },
+                    'counters': dict(self.counters),
+                    }
+            if self.keep_spans:
+                snapshot['spans'] = list(self.spans)
+        return snapshot
+
+    def to_json(self, output_file=None) -> str:
+        """
+        Return the snapshot as JSON, also writing it to output_file if a
+        path is given.
+        """
+        data = json.dumps(self.snapshot(), indent=2, sort_keys=True)
+        if output_file is not None:
+            with open(output_file, 'w') as output:
+                output.write(data)
+            logger.debug('Wrote metrics to %s', output_file)
+        return data
+
+
+metrics = Metrics()
@@ -1,51 +1,127 @@
-import sys
-from pathlib import Path
-
-file = Path(__file__).resolve()
-package_root_directory = file.parents[1]
-sys.path.append(str(package_root_directory))
-
 from lxml import etree as et
 from uuid import uuid4 as uuid
 from datetime import datetime
 
 #  local imports
-from pydex.utils import get_logger, add_subelement_with_text, get_initials
-from pydex.tags import PartyListTags, PartyType
+from pydex.utils import get_logger, get_initials, content_id
+from pydex.tags import PartyListTags, PartyType, SoundRecordingTags
+from pydex.templates import ElementTemplate
+
+logger = get_logger(__name__)
 
-logger = get_logger(__name__, 'ddex')
+PARTY_TEMPLATE = ElementTemplate(PartyListTags.party.value,
+                                 PartyListTags.party_reference.value,
+                                 (PartyListTags.party_name.value, PartyListTags.full_name.value))
+#  Elements pointing from a SoundRecording to a Party in the PartyList, by party type.
+PARTY_REFERENCE_TEMPLATES = {
+        PartyType.artist.value: ElementTemplate(SoundRecordingTags.display_artist.value,
+                                                SoundRecordingTags.artist_party_reference.value),
+        PartyType.contributor.value: ElementTemplate(SoundRecordingTags.contributor.value,
+                                                     SoundRecordingTags.contributor_party_reference.value),
+        }
+
+
+def normalize_name(full_name: str) -> str:
+    """Collapse whitespace and case so spelling variants of a name compare equal."""
+    return ' '.join(full_name.split()).casefold()
 
 
 class Party:
     """
     Builds Party tag
     A party can be an artist of a contributor.
+
+    In deterministic mode the id is derived from the party type and
+    normalized name instead of being random. A reference read back from an
+    existing message can be passed to keep it as is.
     """
+    __slots__ = ('party_type', 'full_name', 'id', 'reference')
 
     def __init__(self,
                  party_type: str,
                  full_name: str,
+                 deterministic: bool = False,
+                 reference: str = None,
                  ):
         self.party_type = party_type  # Artist or Contributor
         self.full_name = full_name
-        self.id = uuid()
+        self.reference = reference
+        if reference is not None:
+            self.id = None
+        elif deterministic:
+            self.id = content_id('Party', party_type, normalize_name(full_name))
+        else:
+            self.id = uuid()
 
     def get_reference(self):
-        logger.debug(f'Getting reference to party of type {self.party_type}')
+        if self.reference is not None:
+            return self.reference
         initials = get_initials(self.full_name)
         return f'P{initials}{str(self.id)}'  # Returns a unique id for the party
     # in format PHRK1024-1024-1024-1024
 
     def write(self):
-        logger.info("Building Party tag.")
-        tag: et.Element = et.Element(PartyListTags.party.value)
-        add_subelement_with_text(tag, PartyListTags.party_reference.value, self.get_reference())
+        logger.debug("Building Party tag.")
+        return PARTY_TEMPLATE.fill(self.get_reference(), self.full_name)
+
+    def write_reference(self):
+        """
+        Builds the DisplayArtist or Contributor tag that points to this
+        party's entry in the PartyList.
+        """
+        return PARTY_REFERENCE_TEMPLATES[self.party_type].fill(self.get_reference())
+
+
+class PartyRegistry:
+    """
+    Interns the parties of a message.
+
+    Every artist or contributor is created once, keyed by party type and
+    normalized name, so it keeps one PartyReference however many tracks it
+    appears on. write() builds the message's PartyList and sound recordings
+    built with the registry only point to it.
 
-        #  Building PartyName
-        logger.info("Building PartyName tag.")
-        party_name_tag: et.Element = et.Element(PartyListTags.party_name.value)
-        add_subelement_with_text(party_name_tag, PartyListTags.full_name.value, self.full_name)
-        tag.append(party_name_tag)
+    When streaming a ResourceList, register every party before writing the
+    PartyList, since it comes first in the message.
 
+    With deterministic set, parties created by the registry get content
+    derived ids, so the same catalog always gets the same references.
+    """
+
+    __slots__ = ('deterministic', 'parties')
+
+    def __init__(self, deterministic: bool = False):
+        self.deterministic = deterministic
+        self.parties = {}
+
+    @staticmethod
+    def normalize(full_name: str) -> str:
+        return normalize_name(full_name)
+
+    def get(self, party_type: str, full_name: str) -> Party:
+        """Return the Party for party_type and full_name, creating it on first use."""
+        key = (party_type, self.normalize(full_name))
+        party = self.parties.get(key)
+        if party is None:
+            party = self.parties[key] = Party(party_type, full_name, self.deterministic)
+        return party
+
+    def intern(self, party: Party) -> Party:
+        """Return the registered Party equal to party, registering it if new."""
+        key = (party.party_type, self.normalize(party.full_name))
+        return self.parties.setdefault(key, party)
+
+    def __len__(self):
+        return len(self.parties)
+
+    def __iter__(self):
+        return iter(self.parties.values())
+
+    def write(self):
+        """Builds the PartyList tag."""
+        logger.debug("Building PartyList tag with %s parties.", len(self.parties))
+        tag: et.Element = et.Element(PartyListTags.root.value)
+        for party in self.parties.values():
+            tag.append(party.write())
         return tag
 
@@ -0,0 +1,152 @@
+"""
+Staged asyncio pipeline for building many messages.
+
+A message goes through four stages: probing and hashing its resource
+files, assembling the element tree, serializing it and writing it out.
+Stages are connected by bounded queues and each runs a configurable number
+of workers, so reads from slow storage overlap with XML work while at most
+a bounded number of messages are in flight.
+"""
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, NamedTuple
+
+from lxml import etree as et
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.config import (TEST_XML_DIR,
+                          PIPELINE_QUEUE_SIZE,
+                          PIPELINE_PROBE_CONCURRENCY,
+                          PIPELINE_BUILD_CONCURRENCY,
+                          PIPELINE_SERIALIZE_CONCURRENCY,
+                          PIPELINE_WRITE_CONCURRENCY)
+from pydex.resource_builder import TechnicalDetails
+from pydex.metrics import metrics
+from pydex.sinks import Sink
+
+logger = get_logger(__name__)
+
+#  Marks the end of a stage's input.
+DONE = object()
+
+
+class BuildJob(NamedTuple):
+    """
+    A message to build.
+    resources holds the keyword arguments of each TechnicalDetails the
+    message needs; assemble receives the built TechnicalDetails in the same
+    order and returns the root element of the message.
+    """
+    output_filename: str
+    resources: List[dict]
+    assemble: Callable
+
+
+class BuildResult(NamedTuple):
+    """
+    Outcome of a BuildJob. error is None if the message was written.
+    """
+    output_filename: str
+    size: int
+    error: Exception
+
+
+class BuildPipeline:
+    """
+    Builds BuildJobs through the probe, assemble, serialize and write stages.
+    """
+
+    def __init__(self,
+                 output_dir: str = TEST_XML_DIR,
+                 queue_size: int = PIPELINE_QUEUE_SIZE,
+                 probe_concurrency: int = PIPELINE_PROBE_CONCURRENCY,
+                 build_concurrency: int = PIPELINE_BUILD_CONCURRENCY,
+                 serialize_concurrency: int = PIPELINE_SERIALIZE_CONCURRENCY,
+                 write_concurrency: int = PIPELINE_WRITE_CONCURRENCY,
+                 pretty_print: bool = True,
+                 ):
+        self.output_dir = output_dir
+        self.queue_size = queue_size
+        self.pretty_print = pretty_print
+        self.stages = [
+                (self.probe, probe_concurrency),
+                (self.assemble, build_concurrency),
+                (self.serialize, serialize_concurrency),
+                (self.write, write_concurrency),
+                ]
+
+    def probe(self, job: BuildJob, _):
+        return [TechnicalDetails(**resource) for resource in job.resources]
+
+    def assemble(self, job: BuildJob, technical_details):
+        return job.assemble(technical_details)
+
+    def serialize(self, job: BuildJob, element):
+        return et.tostring(element,
+                           pretty_print=self.pretty_print,
+                           xml_declaration=True,
+                           encoding='UTF-8')
+
+    def output_path(self, job: BuildJob):
+        return os.path.join(self.output_dir, job.output_filename)
+
+    def write(self, job: BuildJob, data: bytes):
+        path = self.output_path(job)
+        Sink(path).write_bytes(data)
+        logger.debug('Wrote %s bytes to %s', len(data), path)
+        return BuildResult(path, len(data), None)
+
+    def build(self, jobs) -> List[BuildResult]:
+        """Run the pipeline over jobs from synchronous code."""
+        return asyncio.run(self.run(jobs))
+
+    async def run(self, jobs) -> List[BuildResult]:
+        """
+        Build every job in jobs, which may be a lazy iterable: it is only
+        consumed as fast as the first stage has room.
+        Returns one BuildResult per job in completion order. A failing job
+        is reported in its result and does not stop the others.
+        """
+        loop = asyncio.get_running_loop()
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in self.stages]
+        results = []
+
+        with ThreadPoolExecutor(max_workers=sum(concurrency for _, concurrency in self.stages)) as executor:
+            async def worker(work, inbox, outbox):
+                while (item := await inbox.get()) is not DONE:
+                    job, value = item
+                    start = time.perf_counter()
+                    try:
+                        value = await loop.run_in_executor(executor, work, job, value)
+                        metrics.record(f'pipeline.{work.__name__}',
+                                       time.perf_counter() - start,
+                                       {'message': job.output_filename})
+                    except Exception as error:
+                        logger.error('Failed to build %s in %s: %r', job.output_filename, work.__name__, error)
+                        results.append(BuildResult(self.output_path(job), None, error))
+                        continue
+                    if outbox is None:
+                        results.append(value)
+                    else:
+                        await outbox.put((job, value))
+
+            async def run_stage(index):
+                work, concurrency = self.stages[index]
+                outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+                await asyncio.gather(*(worker(work, queues[index], outbox) for _ in range(concurrency)))
+                if outbox is not None:
+                    for _ in range(self.stages[index + 1][1]):
+                        await outbox.put(DONE)
+
+            async def feed():
+                for job in jobs:
+                    await queues[0].put((job, None))
+                for _ in range(self.stages[0][1]):
+                    await queues[0].put(DONE)
+
+            await asyncio.gather(feed(), *(run_stage(index) for index in range(len(self.stages))))
+        logger.info('Pipeline built %s messages.', len(results))
+        return results
@@ -0,0 +1,404 @@
+"""
+Probes resource files for the values written into TechnicalDetails.
+
+Probe results are small picklable records rather than the parser objects
+they were read from, so they can be produced in worker processes and sent
+back cheaply.
+"""
+import os
+import struct
+from typing import NamedTuple
+
+#  local imports
+from pydex.utils import get_logger, format_duration
+from pydex.hashing import hash_file
+from pydex.config import HASH_ALGORITHMS
+from pydex.metrics import metrics
+
+logger = get_logger(__name__)
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+#  PNG IHDR colour type to Pillow mode
+PNG_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+#  JPEG start of frame markers, excluding DHT (C4), JPG (C8) and DAC (CC)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7,
+                    0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+#  JPEG markers that are not followed by a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD8, *range(0xD0, 0xD8)}
+#  JPEG component count to Pillow mode
+JPEG_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+
+#  MPEG audio version bits to version, 1 stands for MPEG 1, 2 for 2 and 2.5
+MPEG_VERSIONS = {0b00: 2.5, 0b10: 2, 0b11: 1}
+MPEG_LAYERS = {0b01: 3, 0b10: 2, 0b11: 1}
+MPEG_SAMPLE_RATES = {
+        1: (44100, 48000, 32000),
+        2: (22050, 24000, 16000),
+        2.5: (11025, 12000, 8000),
+        }
+#  Bitrates in kbps indexed by the 4 bit bitrate index, keyed by (MPEG 1 or not, layer)
+MPEG_BITRATES = {
+        (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+        (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+        (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+        (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+        (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+        }
+#  Bytes read when looking for the first MPEG frame.
+MPEG_SYNC_WINDOW = 16 * 1024
+MPEG_EXTENSIONS = ('.mp3', '.mp2')
+
+
+class AudioProbe(NamedTuple):
+    """
+    Values of an audio file needed to build its TechnicalDetails.
+    """
+    audio_codec: str
+    bitrate: str
+    channels: str
+    sample_rate: str
+    duration: str
+    hash_value: str
+    digests: dict
+    bits_per_sample: int = None
+
+
+class AudioHeader(NamedTuple):
+    """
+    Stream values read from the headers of an audio file.
+    """
+    channels: int
+    sample_rate: int
+    bits_per_sample: int
+    bitrate: float
+    duration: float
+
+
+class ImageProbe(NamedTuple):
+    """
+    Values of an image file needed to build its TechnicalDetails.
+    """
+    height: int
+    width: int
+    mode: str
+    hash_value: str
+    digests: dict
+
+
+def probe_audio(file: str, cache=None) -> AudioProbe:
+    """
+    Reads the stream info and hash of an audio file.
+    Only the extracted values are returned, the audio_metadata object is
+    dropped before returning.
+
+    If a ProbeCache is given it is consulted first and updated on a miss.
+    """
+    if cache is not None:
+        cached = cache.get('audio', file)
+        if cached is not None:
+            logger.debug('Probe cache hit for %s', file)
+            return AudioProbe(**cached)
+    probe = read_audio(file)
+    if cache is not None:
+        cache.put('audio', file, probe._asdict())
+    return probe
+
+
+def read_audio(file: str) -> AudioProbe:
+    logger.debug('Probing audio file %s', file)
+    with metrics.span('probe.audio_header', file=file):
+        header = read_audio_header(file)
+    if header is None:
+        #  Not a format we can read natively, parse it fully with audio_metadata.
+        logger.debug('Falling back to audio_metadata for %s', file)
+        import audio_metadata
+        with metrics.span('probe.audio_metadata', file=file):
+            metadata = audio_metadata.load(file)['streaminfo']
+        header = AudioHeader(channels=metadata.channels,
+                             sample_rate=metadata.sample_rate,
+                             bits_per_sample=getattr(metadata, 'bit_depth', None),
+                             bitrate=metadata.bitrate,
+                             duration=metadata.duration)
+    #  HashSum is the MD5 of the whole delivered file, so it is always computed.
+    digests = hash_file(file, ('md5', *HASH_ALGORITHMS))
+    probe = AudioProbe(
+            audio_codec=file.split('.')[-1],
+            bitrate=str(header.bitrate / 1000),
+            channels=str(header.channels),
+            sample_rate=str(header.sample_rate / 1000),
+            duration=format_duration(header.duration),
+            hash_value=digests['md5'],
+            digests=digests,
+            bits_per_sample=header.bits_per_sample,
+            )
+    logger.debug('Probed %s: %s', file, probe)
+    return probe
+
+
+def read_audio_header(file: str):
+    """
+    Return the AudioHeader of a WAV, FLAC or MP3 file read from its headers
+    alone, or None if the file is in another format or could not be parsed.
+    Only a few KB are read however large the file is.
+
+    Frame sync bytes turn up in any compressed payload, so MPEG frames are
+    only looked for in files that start with an ID3 tag or a frame header,
+    or are named .mp3 or .mp2.
+    """
+    with open(file, 'rb') as data:
+        size = os.fstat(data.fileno()).st_size
+        try:
+            head = data.read(12)
+            if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+                return read_wave_header(data)
+            audio_start = skip_id3v2(head)
+            data.seek(audio_start)
+            if data.read(4) == b'fLaC':
+                return read_flac_header(data, size)
+            if (head[:3] == b'ID3' or parse_mpeg_frame(head[:4]) is not None
+                    or file.lower().endswith(MPEG_EXTENSIONS)):
+                data.seek(audio_start)
+                return read_mpeg_header(data, size)
+        except (struct.error, IndexError, KeyError, ZeroDivisionError):
+            logger.debug('Could not parse audio headers of %s', file)
+    return None
+
+
+def skip_id3v2(head: bytes) -> int:
+    """Return the offset of the first byte after a leading ID3v2 tag."""
+    if head[:3] != b'ID3':
+        return 0
+    flags = head[5]
+    #  Tag size is a 28 bit sync safe integer.
+    tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+    footer = 10 if flags & 0x10 else 0
+    return 10 + tag_size + footer
+
+
+def read_wave_header(data) -> AudioHeader:
+    """Read the RIFF fmt and data chunks, starting right after the WAVE id."""
+    fmt = data_size = None
+    while fmt is None or data_size is None:
+        chunk_id, chunk_size = struct.unpack('<4sI', data.read(8))
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', data.read(16))
+            chunk_size -= 16
+        elif chunk_id == b'data':
+            data_size = chunk_size
+        #  Chunks are word aligned.
+        data.seek(chunk_size + (chunk_size & 1), 1)
+    _, channels, sample_rate, byte_rate, _, bits_per_sample = fmt
+    return AudioHeader(channels=channels,
+                       sample_rate=sample_rate,
+                       bits_per_sample=bits_per_sample,
+                       bitrate=byte_rate * 8,
+                       duration=data_size / byte_rate)
+
+
+def read_flac_header(data, size: int) -> AudioHeader:
+    """
+    Read STREAMINFO and skip over the remaining metadata blocks, starting
+    right after the fLaC marker. Embedded pictures are seeked over, never read.
+    """
+    streaminfo = None
+    last = False
+    while not last:
+        block_header, = struct.unpack('>I', data.read(4))
+        last = bool(block_header >> 31)
+        block_type = (block_header >> 24) & 0x7F
+        block_size = block_header & 0xFFFFFF
+        if block_type == 0:
+            streaminfo = data.read(block_size)
+        else:
+            data.seek(block_size, 1)
+    if streaminfo is None or len(streaminfo) < 18:
+        return None
+    audio_size = size - data.tell()
+    #  Bytes 10-17: sample rate (20 bits), channels - 1 (3), bits per sample - 1 (5),
+    #  total samples (36).
+    packed, = struct.unpack('>Q', streaminfo[10:18])
+    sample_rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits_per_sample = ((packed >> 36) & 0x1F) + 1
+    total_samples = packed & 0xFFFFFFFFF
+    duration = total_samples / sample_rate
+    return AudioHeader(channels=channels,
+                       sample_rate=sample_rate,
+                       bits_per_sample=bits_per_sample,
+                       bitrate=audio_size * 8 / duration if duration else 0,
+                       duration=duration)
+
+
+def read_mpeg_header(data, size: int):
+    """
+    Read the first MPEG audio frame header and its Xing/Info or VBRI header.
+    Without either, the stream is taken to be constant bitrate.
+    Returns None unless two consecutive frames of the same stream are found.
+    """
+    start = data.tell()
+    window = data.read(MPEG_SYNC_WINDOW)
+    offset = window.find(b'\xff')
+    while offset != -1:
+        frame = parse_mpeg_frame(window[offset:offset + 4])
+        if frame is not None:
+            #  Random bytes can look like a frame header, so require the
+            #  next frame to start right where this one ends, with the same
+            #  version, layer and sample rate.
+            following = parse_mpeg_frame(window[offset + frame[5]:offset + frame[5] + 4])
+            if following is not None and following[:2] == frame[:2] and following[3] == frame[3]:
+                break
+        offset = window.find(b'\xff', offset + 1)
+    else:
+        return None
+    version, layer, bitrate, sample_rate, channels, frame_size, samples_per_frame = frame
+    frame_start = offset
+    audio_start = start + frame_start
+    audio_end = size
+    if size >= 128:
+        data.seek(-128, os.SEEK_END)
+        if data.read(3) == b'TAG':
+            audio_end -= 128
+    audio_size = audio_end - audio_start
+
+    #  The Xing header follows the side information of the first frame.
+    if version == 1:
+        side_info = 32 if channels == 2 else 17
+    else:
+        side_info = 17 if channels == 2 else 9
+    xing = frame_start + 4 + side_info
+    vbri = frame_start + 4 + 32
+    num_samples = None
+    constant = True
+    if window[xing:xing + 4] in (b'Xing', b'Info'):
+        constant = window[xing:xing + 4] == b'Info'
+        flags, = struct.unpack('>I', window[xing + 4:xing + 8])
+        if flags & 0x1:
+            frames, = struct.unpack('>I', window[xing + 8:xing + 12])
+            num_samples = frames * samples_per_frame
+            #  LAME stores the encoder delay and padding, drop them from the length.
+            lame = xing + 120
+            if window[lame:lame + 4] == b'LAME':
+                delay_padding = int.from_bytes(window[lame + 21:lame + 24], 'big')
+                padding = (delay_padding >> 12) + (delay_padding & 0xFFF)
+                if padding < num_samples:
+                    num_samples -= padding
+        audio_size -= frame_size
+    elif window[vbri:vbri + 4] == b'VBRI':
+        constant = False
+        frames, = struct.unpack('>I', window[vbri + 14:vbri + 18])
+        num_samples = frames * samples_per_frame
+        audio_size -= frame_size
+
+    if num_samples:
+        duration = num_samples / sample_rate
+    else:
+        duration = audio_size * 8 / bitrate
+    if not constant:
+        bitrate = audio_size * 8 / duration
+    return AudioHeader(channels=channels,
+                       sample_rate=sample_rate,
+                       bits_per_sample=None,
+                       bitrate=bitrate,
+                       duration=duration)
+
+
+def parse_mpeg_frame(header: bytes):
+    """
+    Parse a 4 byte MPEG audio frame header. Returns (version, layer, bitrate,
+    sample_rate, channels, frame_size, samples_per_frame) or None if the
+    bytes are not a valid header.
+    """
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version = MPEG_VERSIONS.get((header[1] >> 3) & 0x3)
+    layer = MPEG_LAYERS.get((header[1] >> 1) & 0x3)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x3
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    padding = (header[2] >> 1) & 0x1
+    channels = 1 if header[3] >> 6 == 0b11 else 2
+    bitrate = MPEG_BITRATES[(version == 1, layer)][bitrate_index] * 1000
+    sample_rate = MPEG_SAMPLE_RATES[version][sample_rate_index]
+    if layer == 1:
+        samples_per_frame = 384
+        frame_size = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples_per_frame = 1152 if layer == 2 or version == 1 else 576
+        frame_size = samples_per_frame // 8 * bitrate // sample_rate + padding
+    return version, layer, bitrate, sample_rate, channels, frame_size, samples_per_frame
+
+
+def probe_image(file: str, cache=None) -> ImageProbe:
+    """
+    Reads the dimensions and hash of an image file.
+    If a ProbeCache is given it is consulted first and updated on a miss.
+    """
+    if cache is not None:
+        cached = cache.get('image', file)
+        if cached is not None:
+            logger.debug('Probe cache hit for %s', file)
+            return ImageProbe(**cached)
+    probe = read_image(file)
+    if cache is not None:
+        cache.put('image', file, probe._asdict())
+    return probe
+
+
+def read_image(file: str) -> ImageProbe:
+    logger.debug('Probing image file %s', file)
+    with metrics.span('probe.image_header', file=file):
+        header = read_image_header(file)
+    if header is None:
+        #  Unknown format, let Pillow figure it out and close it right away.
+        logger.debug('Falling back to Pillow for %s', file)
+        from PIL import Image
+        with metrics.span('probe.pillow', file=file), Image.open(file) as image:
+            header = image.width, image.height, image.mode
+    width, height, mode = header
+    digests = hash_file(file, ('md5', *HASH_ALGORITHMS))
+    return ImageProbe(height=height,
+                      width=width,
+                      mode=mode,
+                      hash_value=digests['md5'],
+                      digests=digests)
+
+
+def read_image_header(file: str):
+    """
+    Return (width, height, mode) read from the PNG IHDR chunk or the JPEG
+    start of frame segment, or None if file is in any other format.
+    Only the header bytes are read and the file is closed before returning.
+    """
+    with open(file, 'rb') as data:
+        head = data.read(26)
+        try:
+            if head.startswith(PNG_SIGNATURE) and head[12:16] == b'IHDR':
+                width, height, _, color_type = struct.unpack('>IIBB', head[16:26])
+                return width, height, PNG_MODES.get(color_type)
+            if head.startswith(b'\xff\xd8'):
+                data.seek(2)
+                return read_jpeg_frame(data)
+        except (struct.error, IndexError):
+            logger.debug('Truncated image header in %s', file)
+    return None
+
+
+def read_jpeg_frame(data):
+    """Walk JPEG segments from the current position up to the first frame header."""
+    while True:
+        marker = data.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        while code == 0xFF:
+            #  Markers may be preceded by any number of fill bytes.
+            code = data.read(1)[0]
+        if code in JPEG_STANDALONE_MARKERS:
+            continue
+        length, = struct.unpack('>H', data.read(2))
+        if code in JPEG_SOF_MARKERS:
+            _, height, width, components = struct.unpack('>BHHB', data.read(6))
+            return width, height, JPEG_MODES.get(components)
+        data.seek(length - 2, 1)
@@ -0,0 +1,249 @@
+"""
+Streaming reader of existing ERN messages.
+
+read_message walks a message with lxml's iterparse and yields pydex
+objects one at a time: the MessageHeader (or a lone MessageParty), every
+Party of the PartyList, every SoundRecording with its TechnicalDetails and
+every Image. Each element is cleared as soon as its object is built, so
+memory stays flat however large the message is.
+
+Only the values pydex writes are read back. Files are not probed again:
+TechnicalDetails are rebuilt from the values in the message.
+"""
+from datetime import datetime
+
+from lxml import etree as et
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.tags import (MessageHeaderTags,
+                        MessagePartyTags,
+                        MessagePartyType,
+                        PartyListTags,
+                        PartyType,
+                        ResourceListTags,
+                        SoundRecordingTags,
+                        TechnicalDetailsTags,
+                        ImageTags)
+from pydex.messageheader import MessageHeader, MessageParty
+from pydex.party import Party, PartyRegistry
+from pydex.probe import AudioProbe, ImageProbe
+from pydex.resource_builder import SoundRecording, TechnicalDetails, ImageRl
+from pydex.metrics import metrics
+
+logger = get_logger(__name__)
+
+#  Elements read into objects. Image is either an ImageRl or the
+#  TechnicalDetails of an image, which pydex writes with the same tag.
+OBJECT_TAGS = frozenset((
+        MessageHeaderTags.root.value,
+        MessagePartyTags.sender.value,
+        MessagePartyTags.receiver.value,
+        PartyListTags.party.value,
+        ResourceListTags.sound_recording.value,
+        TechnicalDetailsTags.root.value,
+        ImageTags.root.value,
+        ))
+#  Lists holding objects, or whatever else pydex does not read, which are
+#  dropped once read through.
+CONTAINER_TAGS = frozenset((
+        PartyListTags.root.value,
+        ResourceListTags.root.value,
+        'ReleaseList',
+        'DealList',
+        ))
+
+#  Paths looked up for every object, resolved from the tag sets once.
+PARTY = PartyListTags.party.value
+PARTY_REFERENCE = PartyListTags.party_reference.value
+PARTY_FULL_NAME = f"{PartyListTags.party_name.value}/{PartyListTags.full_name.value}"
+ARTIST = PartyType.artist.value
+CONTRIBUTOR = PartyType.contributor.value
+SOUND_RECORDING_TYPE = SoundRecordingTags.type.value
+ISRC = f"{SoundRecordingTags.resource_id.value}/{SoundRecordingTags.isrc.value}"
+DISPLAY_TITLE_TEXT = SoundRecordingTags.display_title_text.value
+TITLE_TEXT = f"{SoundRecordingTags.display_title.value}/{SoundRecordingTags.title_text.value}"
+ARTIST_PARTY_REFERENCE = (f"{SoundRecordingTags.display_artist.value}/"
+                          f"{SoundRecordingTags.artist_party_reference.value}")
+CONTRIBUTOR_PARTY_REFERENCE = (f"{SoundRecordingTags.contributor.value}/"
+                               f"{SoundRecordingTags.contributor_party_reference.value}")
+PLINE_TEXT = f"{SoundRecordingTags.pline.value}/{SoundRecordingTags.pline_text.value}"
+PLINE_COMPANY = f"{SoundRecordingTags.pline.value}/{SoundRecordingTags.pline_company.value}"
+PLINE_YEAR = f"{SoundRecordingTags.pline.value}/{SoundRecordingTags.pline_year.value}"
+PARENTAL_WARNING_TYPE = SoundRecordingTags.parental_warning_type.value
+TECHNICAL_DETAILS = TechnicalDetailsTags.root.value
+DETAILS_REFERENCE = TechnicalDetailsTags.details_reference.value
+FILE_URI = f"{TechnicalDetailsTags.file.value}/{TechnicalDetailsTags.uri.value}"
+HASH_SUM_VALUE = (f"{TechnicalDetailsTags.file.value}/{TechnicalDetailsTags.hash_sum.value}/"
+                  f"{TechnicalDetailsTags.hash_sum_value.value}")
+AUDIO_CODEC = TechnicalDetailsTags.audio_codec.value
+BITRATE = TechnicalDetailsTags.bitrate.value
+CHANNELS = TechnicalDetailsTags.channels.value
+SAMPLE_RATE = TechnicalDetailsTags.sample_rate.value
+DURATION = TechnicalDetailsTags.duration.value
+IMAGE_HEIGHT = TechnicalDetailsTags.image_height.value
+IMAGE_WIDTH = TechnicalDetailsTags.image_width.value
+
+
+def read_message(source, party_registry: PartyRegistry = None):
+    """
+    Yield the objects of the message in source, a path or a binary
+    file-like object, in document order.
+
+    Parties of the PartyList are yielded with party_type None, as the list
+    does not record roles. Recordings referring to them get Party objects
+    of the referring role with the same reference, interned into
+    party_registry, so that written again they still point to a PartyList.
+    Parties written inline in a SoundRecording do not record their role
+    either and are read back as artists.
+    """
+    reader = MessageReader(party_registry)
+    #  Only objects and their containers raise events, everything inside
+    #  an object is left to it.
+    tags = [f'{{*}}{tag}' for tag in OBJECT_TAGS | CONTAINER_TAGS]
+    for _, element in et.iterparse(source, tag=tags, remove_comments=True):
+        tag = element.tag.rpartition('}')[2]
+        if tag in OBJECT_TAGS:
+            if any(ancestor.tag in OBJECT_TAGS for ancestor in element.iterancestors()):
+                #  Read along with the object it is part of.
+                continue
+            yield reader.read(tag, element)
+        element.clear(keep_tail=True)
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+    metrics.incr('read.objects', reader.count)
+    logger.debug('Read %s objects.', reader.count)
+
+
+class MessageReader:
+    """
+    Builds pydex objects from message elements, remembering the PartyList
+    so that references can be resolved.
+    """
+
+    def __init__(self, party_registry: PartyRegistry = None):
+        #  PartyReference -> full name
+        self.party_names = {}
+        self.party_registry = party_registry if party_registry is not None else PartyRegistry()
+        self.count = 0
+
+    def read(self, tag, element):
+        self.count += 1
+        if tag == MessageHeaderTags.root.value:
+            return self.read_message_header(element)
+        if tag in (MessagePartyTags.sender.value, MessagePartyTags.receiver.value):
+            return self.read_message_party(element)
+        if tag == PartyListTags.party.value:
+            return self.read_party(element)
+        if tag == ResourceListTags.sound_recording.value:
+            return self.read_sound_recording(element)
+        if element.find(TechnicalDetailsTags.details_reference.value) is not None:
+            return self.read_technical_details(element)
+        return self.read_image(element)
+
+    @staticmethod
+    def read_message_party(element) -> MessageParty:
+        role = (MessagePartyType.sender.value if et.QName(element).localname == MessagePartyTags.sender.value
+                else MessagePartyType.receiver.value)
+        return MessageParty(party_id=element.findtext(MessagePartyTags.party_id.value),
+                            full_name=element.findtext(f"{MessagePartyTags.party_name.value}/"
+                                                       f"{MessagePartyTags.full_name.value}"),
+                            role=role)
+
+    def read_message_header(self, element) -> MessageHeader:
+        created = element.findtext(MessageHeaderTags.message_created_date_time.value)
+        return MessageHeader(sender=self.read_message_party(element.find(MessagePartyTags.sender.value)),
+                             receiver=self.read_message_party(element.find(MessagePartyTags.receiver.value)),
+                             message_control_type=element.findtext(MessageHeaderTags.message_control_type.value),
+                             created_datetime=datetime.fromisoformat(created) if created else None,
+                             thread_id=element.findtext(MessageHeaderTags.thread_id.value),
+                             message_id=element.findtext(MessageHeaderTags.message_id.value))
+
+    def read_party(self, element, party_type=None) -> Party:
+        reference = element.findtext(PARTY_REFERENCE)
+        full_name = element.findtext(PARTY_FULL_NAME)
+        if party_type is None:
+            self.party_names[reference] = full_name
+        return Party(party_type, full_name, reference=reference)
+
+    def read_party_references(self, element, path, party_type):
+        parties = []
+        for reference in element.iterfind(path):
+            name = self.party_names.get(reference.text)
+            if name is None:
+                logger.warning('PartyReference %s is not in the PartyList.', reference.text)
+            party = Party(party_type, name, reference=reference.text)
+            parties.append(self.party_registry.intern(party) if name is not None else party)
+        return parties
+
+    def read_sound_recording(self, element) -> SoundRecording:
+        song_name = element.findtext(TITLE_TEXT)
+        display_title_text = element.findtext(DISPLAY_TITLE_TEXT) or ''
+        suffix = f" - {song_name}"
+        if display_title_text.endswith(suffix):
+            artist_name = display_title_text[:-len(suffix)]
+        else:
+            artist_name = display_title_text
+        inline = [self.read_party(party, ARTIST) for party in element.iterfind(PARTY)]
+        artists = self.read_party_references(element, ARTIST_PARTY_REFERENCE, ARTIST)
+        contributors = self.read_party_references(element, CONTRIBUTOR_PARTY_REFERENCE, CONTRIBUTOR)
+        return SoundRecording(
+                type_=element.findtext(SOUND_RECORDING_TYPE),
+                id_=element.findtext(ISRC),
+                song_name=song_name,
+                artist_name=artist_name,
+                pline_text=element.findtext(PLINE_TEXT),
+                parental_warning_type=element.findtext(PARENTAL_WARNING_TYPE),
+                technical_details=self.read_technical_details(element.find(TECHNICAL_DETAILS)),
+                party=inline + artists,
+                contributor=contributors,
+                pline_company=element.findtext(PLINE_COMPANY),
+                pline_year=element.findtext(PLINE_YEAR),
+                party_registry=None if inline else self.party_registry,
+                display_title_text=display_title_text)
+
+    @staticmethod
+    def read_technical_details(element) -> TechnicalDetails:
+        if element is None:
+            return None
+        reference = element.findtext(DETAILS_REFERENCE)
+        uri = element.findtext(FILE_URI)
+        hash_value = element.findtext(HASH_SUM_VALUE)
+        digests = {'md5': hash_value} if hash_value else {}
+        if element.tag == TECHNICAL_DETAILS:
+            codec = element.find(AUDIO_CODEC)
+            kwargs = {}
+            audio_codec = codec.text if codec is not None else None
+            if codec is not None and codec.get('UserDefinedValue'):
+                audio_codec = codec.get('UserDefinedValue').lower()
+                kwargs['sender_id'] = codec.get('Namespace')
+            probe = AudioProbe(audio_codec=audio_codec,
+                               bitrate=element.findtext(BITRATE),
+                               channels=element.findtext(CHANNELS),
+                               sample_rate=element.findtext(SAMPLE_RATE),
+                               duration=element.findtext(DURATION),
+                               hash_value=hash_value,
+                               digests=digests)
+            #  Audio references are written as T<resource uuid>.
+            return TechnicalDetails.from_probe(uri, reference[1:] if reference else reference, probe, **kwargs)
+        height = element.findtext(IMAGE_HEIGHT)
+        width = element.findtext(IMAGE_WIDTH)
+        probe = ImageProbe(height=int(height) if height else None,
+                           width=int(width) if width else None,
+                           mode=None,
+                           hash_value=hash_value,
+                           digests=digests)
+        return TechnicalDetails.from_probe(uri, reference, probe)
+
+    @staticmethod
+    def read_image(element) -> ImageRl:
+        resource_id = element.find(f"{ImageTags.resource_id.value}/{ImageTags.proprietary_id.value}")
+        id_value = resource_id.text if resource_id is not None else None
+        #  Written as T<id value>IMG.
+        if id_value and id_value.startswith('T') and id_value.endswith('IMG'):
+            id_value = id_value[1:-3]
+        return ImageRl(resource_reference=element.findtext(ImageTags.resource_reference.value),
+                       id_value=id_value,
+                       type_=element.findtext(ImageTags.type_.value),
+                       sender_id=resource_id.get('Namespace') if resource_id is not None else None,
+                       technical_details=None)
@@ -0,0 +1,123 @@
+"""
+Builds whole NewReleaseMessages from release descriptions.
+
+A release description is the dict documented in validation. Several
+releases can go into one message as long as they share the sender and
+receiver; their parties are interned into a single PartyList.
+"""
+from uuid import uuid4 as uuid
+
+from lxml import etree as et
+
+#  local imports
+from pydex.utils import get_logger, content_id
+from pydex.tags import (MessageTags,
+                        MessageControlType,
+                        MessagePartyType,
+                        PartyType,
+                        TechnicalDetailsType)
+from pydex.messageheader import MessageHeader, MessageParty
+from pydex.party import PartyRegistry
+from pydex.resource_builder import ResourceList, SoundRecording, TechnicalDetails, ImageRl
+from pydex.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+def build_message(releases,
+                  deterministic: bool = False,
+                  created_datetime=None,
+                  thread_id: str = None,
+                  message_id: str = None,
+                  cache=None,
+                  fragment_cache=None,
+                  ) -> et.Element:
+    """
+    Builds the NewReleaseMessage root element of one release description
+    or a list of them.
+
+    Files are probed one after the other in this process, going through the
+    ProbeCache cache if one is given. To use several cores, build several
+    messages in parallel instead (see sharding).
+    """
+    if isinstance(releases, dict):
+        releases = [releases]
+    first = releases[0]
+    for release in releases[1:]:
+        if (release['sender'], release['receiver']) != (first['sender'], first['receiver']):
+            raise ValueError('Releases of one message must share the sender and receiver')
+
+    with metrics.span('build.message', message=message_id):
+        sender = MessageParty(role=MessagePartyType.sender.value, **first['sender'])
+        receiver = MessageParty(role=MessagePartyType.receiver.value, **first['receiver'])
+        header = MessageHeader(sender,
+                               receiver,
+                               first.get('message_control_type', MessageControlType.live.value),
+                               created_datetime=created_datetime,
+                               deterministic=deterministic,
+                               thread_id=thread_id,
+                               message_id=message_id)
+        registry = PartyRegistry(deterministic=deterministic)
+        sound_recordings = []
+        images = []
+        for release in releases:
+            sound_recordings.extend(build_sound_recordings(release, registry, deterministic, cache))
+            images.append(build_image(release, deterministic, cache))
+        resource_list = ResourceList(sound_recordings, images, fragment_cache=fragment_cache)
+
+        root = et.Element(f"{{{MessageTags.namespace.value}}}{MessageTags.root.value}",
+                          nsmap={MessageTags.prefix.value: MessageTags.namespace.value})
+        root.set(MessageTags.language_and_script_code.value, 'en')
+        root.append(header.write())
+        #  Every party is registered by now, so the PartyList is complete.
+        root.append(registry.write())
+        root.append(resource_list.write())
+    logger.debug('Built message %s with %s releases and %s sound recordings.',
+                 header.message_id, len(releases), len(sound_recordings))
+    return root
+
+
+def resource_uuid(file: str, deterministic: bool) -> str:
+    if deterministic:
+        return content_id('TechnicalDetails', file)
+    return str(uuid())
+
+
+def build_sound_recordings(release: dict, registry: PartyRegistry, deterministic=False, cache=None):
+    """Returns the SoundRecordings of release, registering their parties."""
+    sender_id = release['sender']['party_id']
+    return [
+            SoundRecording(type_=track['type'],
+                           id_=track['isrc'],
+                           song_name=track['song_name'],
+                           artist_name=track['artist_name'],
+                           pline_text=track['pline_text'],
+                           parental_warning_type=track['parental_warning_type'],
+                           technical_details=TechnicalDetails(type_=TechnicalDetailsType.audio.value,
+                                                              file=track['file'],
+                                                              resource_uuid=resource_uuid(track['file'],
+                                                                                          deterministic),
+                                                              sender_id=sender_id,
+                                                              cache=cache),
+                           party=[registry.get(PartyType.artist.value, name)
+                                  for name in track.get('artists', [])],
+                           contributor=[registry.get(PartyType.contributor.value, name)
+                                        for name in track.get('contributors', [])],
+                           pline_company=track.get('pline_company'),
+                           pline_year=track.get('pline_year'),
+                           party_registry=registry,
+                           deterministic=deterministic)
+            for track in release['sound_recordings']
+            ]
+
+
+def build_image(release: dict, deterministic=False, cache=None) -> ImageRl:
+    image = release['image']
+    return ImageRl(resource_reference=image['resource_reference'],
+                   id_value=image['id_value'],
+                   type_=image['type'],
+                   sender_id=release['sender']['party_id'],
+                   technical_details=TechnicalDetails(type_=TechnicalDetailsType.image.value,
+                                                      file=image['file'],
+                                                      resource_uuid=resource_uuid(image['file'], deterministic),
+                                                      cache=cache))
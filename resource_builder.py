@@ -1,27 +1,23 @@
 import os
-import sys
-from pathlib import Path
-from typing import List
+from typing import Iterable, List
 
-file = Path(__file__).resolve()
-package_root_directory = file.parents[1]
-sys.path.append(str(package_root_directory))
-
-import audio_metadata
-from mp3hash import mp3hash
-from PIL import Image
 from lxml import etree as et
 from uuid import uuid4 as uuid
 from enum import Enum
 
 #  local imports
-from pydex.utils import (add_subelement_with_text, 
-                         get_logger, 
-                         format_duration,
-                         compute_image_hash)
+from pydex.utils import add_subelement_with_text, get_logger, content_id, fingerprint
+from pydex.metrics import metrics
+from pydex.sinks import Sink
+from pydex.templates import ElementTemplate
+from pydex.probe import AudioProbe, ImageProbe, probe_audio, read_audio, probe_image
 from pydex.config import LOG_DIR, TEST_XML_DIR, FIXTURES_DIR
+from pydex.table import read_table
+from pydex.party import Party
+from pydex.validation import validate_table
 from pydex.tags import (ResourceListTags, 
                         SoundRecordingTags, 
+                        PartyType,
                         TechnicalDetailsType,
                         TechnicalDetailsTags,
                         ImageType,
@@ -29,36 +25,188 @@ from pydex.tags import (ResourceListTags,
 from pydex.exceptions import (
         MissingAttribute,
         InvalidTypeError,
+        ProbeError,
         )
 
-logger = get_logger(__name__, 'ddex')
+logger = get_logger(__name__)
+
+HASH_SUM_TEMPLATE = ElementTemplate(TechnicalDetailsTags.hash_sum.value,
+                                    TechnicalDetailsTags.algorithm.value,
+                                    TechnicalDetailsTags.hash_sum_value.value)
+RESOURCE_ID_TEMPLATE = ElementTemplate(SoundRecordingTags.resource_id.value,
+                                       SoundRecordingTags.isrc.value)
+DISPLAY_TITLE_TEMPLATE = ElementTemplate(SoundRecordingTags.display_title.value,
+                                         SoundRecordingTags.title_text.value)
+#  PLineCompany and PLineYear are optional, keyed by (has company, has year).
+PLINE_TEMPLATES = {
+        (has_company, has_year): ElementTemplate(
+            SoundRecordingTags.pline.value,
+            SoundRecordingTags.pline_text.value,
+            *([SoundRecordingTags.pline_company.value] if has_company else []),
+            *([SoundRecordingTags.pline_year.value] if has_year else []),
+            )
+        for has_company in (False, True)
+        for has_year in (False, True)
+        }
 
 
 class ResourceList:
     """
     Builds ResourceList tag
+
+    image is an ImageRl, or a list of them when the message holds several
+    releases.
+
+    With a FragmentCache, unchanged SoundRecording, TechnicalDetails and
+    Image fragments are spliced in from the cache instead of being rebuilt.
     """
 
-    def __init__(self, sound_recording: list, image: et.Element):
-        if isinstance(sound_recording, list):
-            logger.debug(f'Creating ResourceList with {len(sound_recording)} sound recordings')
+    def __init__(self, sound_recording: Iterable, image: et.Element, fragment_cache=None):
+        #  Any iterable is accepted so that huge catalogs can be passed in
+        #  as generators. A generator can only be consumed once, so either
+        #  write() or write_stream() can be called on it, not both.
+        if isinstance(sound_recording, Iterable) and not isinstance(sound_recording, (str, bytes)):
+            logger.debug('Creating ResourceList from %s of sound recordings', type(sound_recording).__name__)
             self.sound_recording = sound_recording
         else:
-            # TODO: need to test raising TypeError
-            logger.error(f'Expected list, got {type(sound_recording)}')
-            raise TypeError('sound_recording must be of type list')
+            logger.error('Expected an iterable, got %s', type(sound_recording))
+            raise TypeError('sound_recording must be an iterable of SoundRecording')
         self.image = image
+        self.fragment_cache = fragment_cache
+
+    @classmethod
+    def from_table(cls, table, image, sender_id=None, party_registry=None,
+                   workers=None, deterministic=False, check_files=True, **kwargs):
+        """
+        Builds a ResourceList from tabular catalog metadata, one sound
+        recording per row (see table.read_table for the accepted inputs).
+
+        The work is done a column at a time: the whole table is validated
+        up front, raising ValidationError with every problem, display
+        titles are built in one pass and all files are probed in a process
+        pool through TechnicalDetails.from_files, which also takes the
+        cache kwarg. The SoundRecordings themselves are only created while
+        the list is written, so write_stream never holds all of them.
+
+        Raises the first ProbeError if any file could not be probed.
+        """
+        columns = read_table(table)
+        validate_table(columns, check_files=check_files).raise_for_problems()
+        rows = len(columns['isrc'])
+        logger.info('Building ResourceList from a table of %s rows.', rows)
+
+        display_titles = [f"{artist_name} - {song_name}"
+                          for artist_name, song_name in zip(columns['artist_name'], columns['song_name'])]
+        technical_details = TechnicalDetails.from_files(columns['file'],
+                                                        workers=workers,
+                                                        deterministic=deterministic,
+                                                        sender_id=sender_id,
+                                                        **kwargs)
+        failed = [details for details in technical_details if isinstance(details, ProbeError)]
+        if failed:
+            logger.error('Failed to probe %s of %s files.', len(failed), rows)
+            raise failed[0]
+
+        empty = [None] * rows
+        artists = columns.get('artists') or [[] for _ in range(rows)]
+        contributors = columns.get('contributors') or [[] for _ in range(rows)]
+
+        def parties(party_type, names):
+            if party_registry is not None:
+                return [party_registry.get(party_type, name) for name in names]
+            return [Party(party_type, name, deterministic) for name in names]
+
+        sound_recordings = (
+                SoundRecording(type_=type_,
+                               id_=isrc,
+                               song_name=song_name,
+                               artist_name=artist_name,
+                               pline_text=pline_text,
+                               parental_warning_type=parental_warning_type,
+                               technical_details=details,
+                               party=parties(PartyType.artist.value, track_artists),
+                               contributor=parties(PartyType.contributor.value, track_contributors),
+                               pline_company=pline_company,
+                               pline_year=pline_year,
+                               party_registry=party_registry,
+                               deterministic=deterministic,
+                               display_title_text=display_title)
+                for (type_, isrc, song_name, artist_name, pline_text, parental_warning_type, details,
+                     track_artists, track_contributors, pline_company, pline_year, display_title)
+                in zip(columns['type'], columns['isrc'], columns['song_name'], columns['artist_name'],
+                       columns['pline_text'], columns['parental_warning_type'], technical_details,
+                       artists, contributors, columns.get('pline_company', empty),
+                       columns.get('pline_year', empty), display_titles)
+                )
+        return cls(sound_recordings, image)
 
     def write(self):
-        logger.info("Building ResourceList tag.")
+        logger.debug("Building ResourceList tag.")
         tag: et.Element = et.Element(ResourceListTags.root.value)
         for sound_recording in self.sound_recording:
-            tag.append(sound_recording.write())
-        tag.append(self.image.write())
+            tag.append(self.build_sound_recording(sound_recording, self.fragment_cache))
+        for image in self.build_images():
+            tag.append(image)
+        return tag
+
+    def build_images(self):
+        images = self.image if isinstance(self.image, (list, tuple)) else [self.image]
+        if self.fragment_cache is None:
+            return [image.write() for image in images]
+        return [self.fragment_cache.build(image) for image in images]
+
+    @staticmethod
+    def build_sound_recording(sound_recording, fragment_cache=None):
+        with metrics.span('build.sound_recording'):
+            if fragment_cache is None:
+                tag = sound_recording.write()
+            else:
+                tag = fragment_cache.build(sound_recording, fragment_cache)
+        if metrics.enabled:
+            metrics.incr('build.elements', sum(1 for _ in tag.iter()))
         return tag
 
+    def write_stream(self, output_file):
+        """
+        Serializes the ResourceList straight to output_file, which can be a
+        path, a binary file-like object or a Sink.
+
+        Unlike write() the full tree is never held in memory: each
+        SoundRecording subtree is built, written and dropped before the
+        next one is pulled from the iterable.
+        """
+        logger.info("Streaming ResourceList tag.")
+        if isinstance(output_file, Sink):
+            with output_file.xmlfile() as xf:
+                return self.write_into(xf)
+        with et.xmlfile(output_file, encoding='utf-8') as xf:
+            xf.write_declaration()
+            return self.write_into(xf)
+
+    def write_into(self, xf):
+        """
+        Writes the ResourceList into an already open lxml xmlfile context,
+        so that it can be embedded in a larger streamed message.
+        Returns the number of sound recordings written.
+        """
+        count = 0
+        with xf.element(ResourceListTags.root.value):
+            for sound_recording in self.sound_recording:
+                xf.write(self.build_sound_recording(sound_recording, self.fragment_cache))
+                count += 1
+            for image in self.build_images():
+                xf.write(image)
+        logger.debug('Streamed %s sound recordings', count)
+        return count
+
 
 class TechnicalDetails:
+    #  Only the probe fields the XML needs are kept, without a per instance
+    #  __dict__. Audio and image details each set their own subset.
+    __slots__ = ('type', 'file', 'resource_uuid', 'audio_codec', 'bitrate', 'channels',
+                 'sample_rate', 'duration', 'hash_value', 'digests', 'bits_per_sample',
+                 'sender_id', 'height', 'width', 'mode')
+
     def __init__(self,
                  type_: Enum,
                  file: str,
@@ -68,65 +216,122 @@ class TechnicalDetails:
         self.type = type_
         self.file = file
         self.resource_uuid = resource_uuid
+        cache = kwargs.get('cache')
 
         if type_ == TechnicalDetailsType.audio.value:
             logger.debug('Initializing TechnicalDetails of Audio Type')
-            self.audio_data = audio_metadata.load(file)
-            logger.debug(f'Loaded audio_data from {self.file}')
-            self.metadata = self.audio_data['streaminfo']
-            logger.debug('Loaded audio_metadata.')
-            self.audio_codec = self.audio_data.filepath.split('.')[-1]
-            logger.debug(f'Found audio codec from file: {self.audio_codec}')
-            self.bitrate = str(self.metadata.bitrate / 1000)
-            logger.debug(f"Found bitrate to be {self.bitrate}")
-            self.channels = str(self.metadata.channels)
-            logger.debug(f"Found channels to be {self.channels}")
-            self.sample_rate = str(self.metadata.sample_rate / 1000)
-            logger.debug(f"Found sample_rate to be {self.sample_rate}")
-            logger.debug(f"Sending duration {self.metadata.duration} to be formatted.")
-            self.duration = format_duration(self.metadata.duration)
-            logger.debug(f"Found formatted duration to be {self.duration}")
-            try:
-                self.hash_value = mp3hash(file)
-            except TypeError:
-                logger.error('Got TypeError mp3hash might not be imported correctly.')
-            logger.debug(f"Computed hash of the file {self.hash_value}.")
-
-            #  Check if audio_codec value is WAV
-            if self.audio_codec == 'wav':
-                if kwargs.get('sender_id'):
-                    self.sender_id = kwargs.get('sender_id')
-                else:
-                    logger.error(f"sender_id was not provided for filetype {self.audio_codec}")
-                    raise MissingAttribute(self.audio_codec)
+            self.set_audio_probe(probe_audio(file, cache), **kwargs)
 
         if type_ == TechnicalDetailsType.image.value:
             logger.debug('Initializing TechnicalDetails of Image Type.')
-            self.image = Image.open(file)
+            self.set_image_probe(probe_image(file, cache))
+
+    @classmethod
+    def from_probe(cls, file: str, resource_uuid: str, probe: AudioProbe, **kwargs):
+        """
+        Builds TechnicalDetails from an already computed AudioProbe or
+        ImageProbe instead of reading the file again.
+        """
+        technical_details = cls.__new__(cls)
+        technical_details.file = file
+        technical_details.resource_uuid = resource_uuid
+        if isinstance(probe, ImageProbe):
+            technical_details.type = TechnicalDetailsType.image.value
+            technical_details.set_image_probe(probe)
+        else:
+            technical_details.type = TechnicalDetailsType.audio.value
+            technical_details.set_audio_probe(probe, **kwargs)
+        return technical_details
+
+    @classmethod
+    def from_files(cls, files, resource_uuids=None, workers=None, deterministic=False, **kwargs):
+        """
+        Builds audio TechnicalDetails for many files, probing and hashing
+        them in a pool of worker processes.
+
+        Results are returned in the order of files. A file that could not
+        be probed does not stop the batch: its slot holds a ProbeError
+        instead of a TechnicalDetails object.
 
+        If a ProbeCache is passed as cache, files whose identity has not
+        changed are served from it and never reach the pool.
+
+        Without resource_uuids, each file gets a random one, or one derived
+        from its path if deterministic is set.
+        """
+        files = list(files)
+        if resource_uuids is None and deterministic:
+            resource_uuids = [content_id('TechnicalDetails', file) for file in files]
+        elif resource_uuids is None:
+            resource_uuids = [str(uuid()) for _ in files]
+        cache = kwargs.get('cache')
+        logger.info('Probing %s audio files with %s workers.', len(files), workers or "default")
+        results = []
+        #  multiprocessing is slow to import and only needed here.
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = []
+            for file in files:
+                cached = cache.get('audio', file) if cache is not None and os.path.exists(file) else None
+                if cached is not None:
+                    pending.append(AudioProbe(**cached))
+                else:
+                    pending.append(executor.submit(read_audio, file))
+            for file, resource_uuid, probe in zip(files, resource_uuids, pending):
+                try:
+                    if not isinstance(probe, AudioProbe):
+                        probe = probe.result()
+                        if cache is not None:
+                            cache.put('audio', file, probe._asdict())
+                    results.append(cls.from_probe(file, resource_uuid, probe, **kwargs))
+                except Exception as error:
+                    logger.error('Failed to probe %s: %r', file, error)
+                    results.append(ProbeError(file, error))
+        return results
+
+    def set_audio_probe(self, probe: AudioProbe, **kwargs):
+        self.audio_codec = probe.audio_codec
+        logger.debug('Found audio codec from file: %s', self.audio_codec)
+        self.bitrate = probe.bitrate
+        self.channels = probe.channels
+        self.sample_rate = probe.sample_rate
+        self.duration = probe.duration
+        self.hash_value = probe.hash_value
+        self.digests = probe.digests
+        self.bits_per_sample = probe.bits_per_sample
+
+        #  Check if audio_codec value is WAV
+        if self.audio_codec == 'wav':
+            if kwargs.get('sender_id'):
+                self.sender_id = kwargs.get('sender_id')
+            else:
+                logger.error("sender_id was not provided for filetype %s", self.audio_codec)
+                raise MissingAttribute(self.audio_codec)
+
+    def set_image_probe(self, probe: ImageProbe):
+        self.height = probe.height
+        self.width = probe.width
+        self.mode = probe.mode
+        self.hash_value = probe.hash_value
+        self.digests = probe.digests
 
     def get_reference(self):
-        logger.debug('Building technical resource reference id.')
         return f"T{self.resource_uuid}"
 
-    def build_hash_sum(self):
-        tag = et.Element(TechnicalDetailsTags.hash_sum.value)
-        add_subelement_with_text(tag,
-                                 TechnicalDetailsTags.algorithm.value,
-                                 "MD5")
-        if self.type == TechnicalDetailsType.audio.value:
-            add_subelement_with_text(tag,
-                                    TechnicalDetailsTags.hash_sum_value.value,
-                                    self.hash_value)
+    def fingerprint(self):
+        """Return a fingerprint of everything write() depends on."""
         if self.type == TechnicalDetailsType.image.value:
-            hash_value = compute_image_hash(self.file)
-            add_subelement_with_text(tag,
-                                     TechnicalDetailsTags.hash_sum_value.value,
-                                     hash_value)
-        return tag
+            return fingerprint('TechnicalDetails', self.type, self.file, self.resource_uuid,
+                               self.height, self.width, self.hash_value)
+        return fingerprint('TechnicalDetails', self.type, self.file, self.resource_uuid,
+                           self.audio_codec, self.channels, self.sample_rate, self.bitrate,
+                           self.duration, self.hash_value, getattr(self, 'sender_id', None))
+
+    def build_hash_sum(self):
+        return HASH_SUM_TEMPLATE.fill("MD5", self.hash_value)
 
     def build_file(self):
-        logger.debug(f"Building file for type {self.type}")
+        logger.debug("Building file for type %s", self.type)
         tag = et.Element(TechnicalDetailsTags.file.value)
         add_subelement_with_text(tag,
                                 TechnicalDetailsTags.uri.value,
@@ -135,9 +340,8 @@ class TechnicalDetails:
         return tag
 
     def build_audio_technical_details(self):
-        logger.info('Building technical details for Audio type.')
+        logger.debug('Building technical details for Audio type.')
         tag = et.Element(TechnicalDetailsTags.root.value)
-        logger.debug('Got root ready.')
         add_subelement_with_text(tag, 
                                  TechnicalDetailsTags.details_reference.value,
                                  self.get_reference())
@@ -174,17 +378,15 @@ class TechnicalDetails:
                                  self.resource_uuid)
         add_subelement_with_text(tag,
                                  TechnicalDetailsTags.image_height.value,
-                                 str(self.image.height))
+                                 str(self.height))
         add_subelement_with_text(tag,
                                  TechnicalDetailsTags.image_width.value,
-                                 str(self.image.width))
+                                 str(self.width))
         tag.append(self.build_file())
         return tag
 
 
     def write(self):
-        logger.debug("Inside write function.")
-        logger.debug(f"Type: {self.type}")
         if self.type == TechnicalDetailsType.audio.value:
             logger.debug("Building audio type TechnicalDetails")
             return self.build_audio_technical_details()
@@ -197,7 +399,14 @@ class TechnicalDetails:
 class SoundRecording:
     """
     Builds SoundRecording tag
+
+    In deterministic mode references are derived from the ISRC instead of
+    being random.
     """
+    __slots__ = ('type', 'id', 'song_name', 'artist_name', 'pline_text',
+                 'parental_warning_type', 'technical_details', 'party', 'contributor',
+                 'pline_company', 'pline_year', 'party_registry', 'deterministic',
+                 'display_title_text')
 
     def __init__(
             self,
@@ -212,6 +421,9 @@ class SoundRecording:
             contributor: List[et.Element],
             pline_company=None,
             pline_year=None,
+            party_registry=None,
+            deterministic=False,
+            display_title_text=None,
     ):
         self.type = type_
         self.id = id_
@@ -224,64 +436,81 @@ class SoundRecording:
         self.contributor = contributor
         self.pline_company = pline_company
         self.pline_year = pline_year
+        #  With a PartyRegistry, parties are written once in its PartyList
+        #  and the recording only holds references to them.
+        self.party_registry = party_registry
+        self.deterministic = deterministic
+        #  Precomputed by bulk builders, otherwise built from artist and song name.
+        self.display_title_text = display_title_text
+        if party_registry is not None:
+            self.party = [party_registry.intern(party) for party in party]
+            self.contributor = [party_registry.intern(party) for party in contributor]
 
-    @staticmethod
-    def get_reference():
+    def get_reference(self):
         """
-        Return a uuid4 string
+        Return a uuid4 string, or one derived from the ISRC in deterministic mode
         """
-        logger.debug('Setting reference to sound recording')
+        if self.deterministic:
+            return f"A{content_id('SoundRecording', self.id)}"
         return f"A{str(uuid())}"
 
+    def fingerprint(self):
+        """Return a fingerprint of everything write() depends on."""
+        return fingerprint('SoundRecording', self.type, self.id, self.song_name, self.artist_name,
+                           self.pline_text, self.pline_company, self.pline_year,
+                           self.parental_warning_type, self.party_registry is not None,
+                           self.display_title_text,
+                           [(party.party_type, party.full_name, party.get_reference())
+                            for party in [*self.party, *self.contributor]],
+                           self.technical_details.fingerprint())
+
     def build_resource_id(self):
         """
         Builds ResourceId tag
         """
-        logger.info("Building ResourceId tag.")
-        tag: et.Element = et.Element(SoundRecordingTags.resource_id.value)
-        add_subelement_with_text(tag, SoundRecordingTags.isrc.value, self.id)
-        return tag
+        logger.debug("Building ResourceId tag.")
+        return RESOURCE_ID_TEMPLATE.fill(self.id)
 
     def build_display_title(self):
         """
         Builds DisplayTitle tag
         """
-        logger.info("Building DisplayTitle tag.")
-        tag: et.Element = et.Element(SoundRecordingTags.display_title.value)
-        add_subelement_with_text(tag, SoundRecordingTags.title_text.value, self.song_name)
-        return tag
+        logger.debug("Building DisplayTitle tag.")
+        return DISPLAY_TITLE_TEMPLATE.fill(self.song_name)
 
     def build_pline(self):
         """
         Builds PLine tag
         """
-        logger.info("Building PLine tag.")
-        tag: et.Element = et.Element(SoundRecordingTags.pline.value)
-        add_subelement_with_text(tag, SoundRecordingTags.pline_text.value, self.pline_text)
-        if self.pline_company:
-            add_subelement_with_text(tag, SoundRecordingTags.pline_company.value, self.pline_company)
-        if self.pline_year:
-            add_subelement_with_text(tag, SoundRecordingTags.pline_year.value, self.pline_year)
-        return tag
+        logger.debug("Building PLine tag.")
+        texts = [text for text in (self.pline_company, self.pline_year) if text]
+        template = PLINE_TEMPLATES[(bool(self.pline_company), bool(self.pline_year))]
+        return template.fill(self.pline_text, *texts)
 
-    def write(self):
+    def write(self, fragment_cache=None):
         """
-        Builds SoundRecording tag
+        Builds SoundRecording tag, taking its TechnicalDetails from
+        fragment_cache if one is given.
         """
-        logger.info("Building SoundRecording tag.")
+        logger.debug("Building SoundRecording tag.")
         tag: et.Element = et.Element(ResourceListTags.sound_recording.value)
         add_subelement_with_text(tag, SoundRecordingTags.type.value, self.type)
-        logger.debug('Writing type tag of sound recording')
         tag.append(self.build_resource_id())
         add_subelement_with_text(tag,
                                  SoundRecordingTags.display_title_text.value,
-                                 f"{self.artist_name} - {self.song_name}"
+                                 self.display_title_text or f"{self.artist_name} - {self.song_name}"
                                  )
         tag.append(self.build_display_title())
-        for party in self.party:
-            tag.append(party.write())
-        for contributor in self.contributor:
-            tag.append(contributor.write())
+        if self.party_registry is None:
+            for party in self.party:
+                tag.append(party.write())
+            for contributor in self.contributor:
+                tag.append(contributor.write())
+        else:
+            for party in self.party:
+                tag.append(party.write_reference())
+            for contributor in self.contributor:
+                tag.append(contributor.write_reference())
         tag.append(self.build_pline())
         add_subelement_with_text(tag,
                                  SoundRecordingTags.duration.value,
@@ -291,11 +520,16 @@ class SoundRecording:
                                  SoundRecordingTags.parental_warning_type.value,
                                  self.parental_warning_type
                                  )
-        tag.append(self.technical_details.write())
+        if fragment_cache is None:
+            tag.append(self.technical_details.write())
+        else:
+            tag.append(fragment_cache.build(self.technical_details))
         return tag
 
 
 class ImageRl:
+    __slots__ = ('resource_reference', 'id_value', 'type', 'sender_id', 'technical_details')
+
     def __init__(self,
                  resource_reference: str,
                  id_value: str,
@@ -311,6 +545,10 @@ class ImageRl:
         self.sender_id = sender_id
         self.technical_details = technical_details
 
+    def fingerprint(self):
+        """Return a fingerprint of everything write() depends on."""
+        return fingerprint('Image', self.resource_reference, self.id_value, self.type, self.sender_id)
+
     def build_resource_id(self):
         tag = et.Element(ImageTags.resource_id.value)
         add_subelement_with_text(tag,
@@ -320,9 +558,8 @@ class ImageRl:
         return tag
 
     def write(self):
-        logger.info("Building Image tag.")
+        logger.debug("Building Image tag.")
         tag = et.Element(ImageTags.root.value)
-        logger.debug("Got root value.")
         add_subelement_with_text(tag,
                                  ImageTags.resource_reference.value,
                                  self.resource_reference)
@@ -0,0 +1,120 @@
+"""
+XSD validation of built messages.
+
+The DDEX ERN schema is large and compiling it takes far longer than
+validating a message against it, so it is compiled once per process from
+the local SCHEMA_DIR and reused. Elements returned by the builders are
+validated as they are, without serializing and parsing them again, and
+many message files can be validated in a pool of worker processes, each
+compiling the schema once.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, NamedTuple
+
+from lxml import etree as et
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.config import SCHEMA_DIR, SCHEMA_FILE
+from pydex.exceptions import SchemaValidationError
+from pydex.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class SchemaProblem(NamedTuple):
+    """
+    A single schema violation. path is the XPath of the offending element,
+    line is only known for parsed files.
+    """
+    line: int
+    path: str
+    type: str
+    message: str
+
+    def __str__(self):
+        return f"{self.path} (line {self.line}): {self.message}"
+
+
+class SchemaResult(NamedTuple):
+    """Outcome of validating one message file with validate_many."""
+    source: str
+    problems: List[SchemaProblem]
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+
+def schema_path(schema_dir: str = SCHEMA_DIR, schema_file: str = SCHEMA_FILE) -> str:
+    return os.path.abspath(os.path.join(schema_dir, schema_file))
+
+
+def load_schema(path: str = None) -> et.XMLSchema:
+    """
+    Return the compiled XMLSchema at path, SCHEMA_DIR/SCHEMA_FILE by
+    default. Each schema is compiled once per process, however its path
+    is spelled.
+    Imported and included schemas are resolved relative to path. The
+    schema keeps the error log of its last validation, so do not validate
+    with it from several threads at once.
+    """
+    return _compile_schema(os.path.abspath(path or schema_path()))
+
+
+@lru_cache(maxsize=None)
+def _compile_schema(path: str) -> et.XMLSchema:
+    logger.info('Compiling XML schema %s', path)
+    with metrics.span('schema.compile', schema=path):
+        return et.XMLSchema(et.parse(path))
+
+
+def validate_element(element, schema: et.XMLSchema = None) -> List[SchemaProblem]:
+    """
+    Validate an element, e.g. the root returned by release.build_message,
+    and return its problems. The element is validated as the root of a
+    document, so the schema must declare its tag globally.
+    """
+    schema = schema or load_schema()
+    with metrics.span('schema.validate'):
+        valid = schema.validate(element)
+    if valid:
+        return []
+    return [SchemaProblem(error.line, error.path, error.type_name, error.message)
+            for error in schema.error_log]
+
+
+def assert_valid(element, schema: et.XMLSchema = None):
+    """Raise SchemaValidationError with every problem if element is not valid."""
+    problems = validate_element(element, schema)
+    if problems:
+        raise SchemaValidationError(problems)
+
+
+def validate_file(source: str, path: str = None) -> SchemaResult:
+    """
+    Parse and validate the message file at source against the schema at
+    path. A file that cannot be parsed is reported as a single problem.
+    """
+    try:
+        element = et.parse(source).getroot()
+    except (OSError, et.XMLSyntaxError) as error:
+        return SchemaResult(source, [SchemaProblem(getattr(error, 'lineno', None), None,
+                                                   type(error).__name__, str(error))])
+    return SchemaResult(source, validate_element(element, load_schema(path)))
+
+
+def validate_many(sources, path: str = None, workers: int = None) -> List[SchemaResult]:
+    """
+    Validate many message files in a pool of worker processes, returning
+    one SchemaResult per file in the order of sources.
+    """
+    path = os.path.abspath(path or schema_path())
+    sources = list(sources)
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_schema, initargs=(path,)) as executor:
+        results = list(executor.map(validate_file, sources, [path] * len(sources)))
+    logger.info('Validated %s messages, %s invalid.',
+                len(results), sum(1 for result in results if not result.ok))
+    return results
@@ -0,0 +1,234 @@
+"""
+Long-running build server.
+
+Starting Python and importing lxml and the probers costs more than
+building a small single, so the server keeps a pool of preforked worker
+processes with everything imported. Each worker opens the on-disk
+ProbeCache once, shared by all workers through SQLite, so files probed by
+any of them are not probed again.
+
+Release descriptions (see validation) are POSTed as JSON to /build over
+HTTP on a TCP port or a Unix socket:
+
+    python -m pydex.server --port 8765 --workers 4
+    curl --data @release.json http://127.0.0.1:8765/build
+
+The response is the ERN XML. With ?output=<name> the message is written
+to the server's output directory instead and the response is a JSON
+summary. Invalid input gets a 400 with every problem, and requests over
+the pending limit get a 503 right away instead of queueing without bound.
+"""
+import argparse
+import json
+import os
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from lxml import etree as et
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.config import (CACHE_DIR,
+                          TEST_XML_DIR,
+                          SERVER_HOST,
+                          SERVER_PORT,
+                          SERVER_WORKERS,
+                          SERVER_MAX_PENDING,
+                          SERVER_TIMEOUT)
+from pydex.cache import ProbeCache
+from pydex.metrics import metrics
+from pydex.release import build_message
+from pydex.sinks import Sink
+from pydex.validation import validate_releases
+
+logger = get_logger(__name__)
+
+#  Set in every worker process by init_worker.
+worker_cache = None
+
+
+def init_worker(cache_dir):
+    global worker_cache
+    worker_cache = ProbeCache(cache_dir) if cache_dir else None
+    logger.debug('Worker %s ready.', os.getpid())
+
+
+def build_release(release: dict, output_path: str = None, pretty_print: bool = False,
+                  deterministic: bool = False):
+    """
+    Build a validated release in a worker process. Returns the serialized
+    message, or its size once written to output_path.
+    """
+    root = build_message(release, deterministic=deterministic, cache=worker_cache)
+    if output_path is None:
+        return et.tostring(root, pretty_print=pretty_print, xml_declaration=True, encoding='UTF-8')
+    Sink(output_path, pretty_print=pretty_print).write(root)
+    return os.path.getsize(output_path)
+
+
+class BuildRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'pydex'
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        #  Unix socket clients have no address.
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+    def send_body(self, status, body: bytes, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        self.send_body(status, json.dumps(data, default=str).encode('utf-8'))
+
+    def do_GET(self):
+        if urlsplit(self.path).path != '/health':
+            return self.send_json(HTTPStatus.NOT_FOUND, {'error': 'not found'})
+        self.send_json(HTTPStatus.OK, self.server.builder.status())
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/build':
+            return self.send_json(HTTPStatus.NOT_FOUND, {'error': 'not found'})
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            release = json.loads(self.rfile.read(length))
+        except ValueError as error:
+            return self.send_json(HTTPStatus.BAD_REQUEST, {'error': f'invalid JSON: {error}'})
+        query = parse_qs(url.query)
+        self.server.builder.handle(self, release, query.get('output', [None])[0],
+                                   query.get('pretty', ['0'])[0] == '1')
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class BuildServer:
+    """
+    Serves builds from a pool of preforked worker processes.
+    At most max_pending builds are queued or running at a time.
+    """
+
+    def __init__(self,
+                 host: str = SERVER_HOST,
+                 port: int = SERVER_PORT,
+                 unix_socket: str = None,
+                 workers: int = SERVER_WORKERS,
+                 max_pending: int = SERVER_MAX_PENDING,
+                 timeout: float = SERVER_TIMEOUT,
+                 output_dir: str = TEST_XML_DIR,
+                 cache_dir: str = CACHE_DIR,
+                 deterministic: bool = False,
+                 ):
+        self.output_dir = output_dir
+        self.timeout = timeout
+        self.deterministic = deterministic
+        self.max_pending = max_pending
+        self.pending = threading.BoundedSemaphore(max_pending) if max_pending else None
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache_dir,))
+        #  Start every worker now rather than on the first requests.
+        for future in [self.executor.submit(os.getpid) for _ in range(workers)]:
+            future.result()
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.unlink(unix_socket)
+            self.httpd = UnixHTTPServer(unix_socket, BuildRequestHandler)
+        else:
+            self.httpd = ThreadingHTTPServer((host, port), BuildRequestHandler)
+        self.httpd.builder = self
+        self.address = self.httpd.server_address
+        logger.info('Build server listening on %s with %s workers.', self.address, workers)
+
+    def handle(self, handler: BuildRequestHandler, release: dict, output: str, pretty_print: bool):
+        if self.pending is not None and not self.pending.acquire(blocking=False):
+            metrics.incr('server.rejected')
+            return handler.send_json(HTTPStatus.SERVICE_UNAVAILABLE, {'error': 'too many pending builds'})
+        future = None
+        try:
+            #  Validated here rather than in the worker, the report is cheap
+            #  to build and does not need to cross the process boundary.
+            report = validate_releases([release])
+            if not report.ok:
+                return handler.send_json(HTTPStatus.BAD_REQUEST,
+                                         {'error': 'invalid release',
+                                          'problems': [problem._asdict() for problem in report.problems]})
+            output_path = None
+            if output is not None:
+                output_path = os.path.join(self.output_dir, os.path.basename(output))
+            with metrics.span('server.build'):
+                future = self.executor.submit(build_release, release, output_path, pretty_print,
+                                              self.deterministic)
+                if self.pending is not None:
+                    #  A build that timed out keeps running in its worker,
+                    #  so its slot is only freed once it is done.
+                    future.add_done_callback(lambda _: self.pending.release())
+                result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            return handler.send_json(HTTPStatus.GATEWAY_TIMEOUT, {'error': 'build timed out'})
+        except Exception as error:
+            logger.error('Build failed: %r', error)
+            return handler.send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': repr(error)})
+        finally:
+            if future is None and self.pending is not None:
+                self.pending.release()
+        if output_path is None:
+            return handler.send_body(HTTPStatus.OK, result, 'application/xml')
+        return handler.send_json(HTTPStatus.OK, {'output': output_path, 'size': result})
+
+    def status(self) -> dict:
+        return {'address': str(self.address), 'max_pending': self.max_pending, 'metrics': metrics.snapshot()}
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        """Stop serving, wait for the workers and remove the Unix socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.executor.shutdown()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve pydex builds over HTTP.')
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--unix-socket')
+    parser.add_argument('--workers', type=int, default=SERVER_WORKERS)
+    parser.add_argument('--max-pending', type=int, default=SERVER_MAX_PENDING)
+    parser.add_argument('--timeout', type=float, default=SERVER_TIMEOUT)
+    parser.add_argument('--output-dir', default=TEST_XML_DIR)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--deterministic', action='store_true')
+    args = parser.parse_args(argv)
+    server = BuildServer(host=args.host,
+                         port=args.port,
+                         unix_socket=args.unix_socket,
+                         workers=args.workers,
+                         max_pending=args.max_pending,
+                         timeout=args.timeout,
+                         output_dir=args.output_dir,
+                         cache_dir=args.cache_dir,
+                         deterministic=args.deterministic)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
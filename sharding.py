@@ -0,0 +1,129 @@
+"""
+Splits huge catalogs into several messages and builds them in parallel.
+
+Some DSPs reject messages over a track or size limit, and one huge message
+is built serially. shard_releases groups release descriptions into shards
+under a track count and an estimated byte size, never splitting a release,
+and build_shards builds and writes every shard in its own worker process.
+All shards of a catalog share one MessageThreadId.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import List, NamedTuple
+from uuid import uuid4 as uuid
+
+#  local imports
+from pydex.utils import get_logger, content_id
+from pydex.config import TEST_XML_DIR, SHARD_MAX_TRACKS, SHARD_MAX_BYTES, SHARD_TRACK_BYTES
+from pydex.pipeline import BuildResult
+from pydex.sinks import Sink
+from pydex.release import build_message
+
+logger = get_logger(__name__)
+
+
+class Shard(NamedTuple):
+    """
+    Releases that go into one message.
+    index is the position of the shard in its catalog.
+    """
+    index: int
+    releases: list
+    tracks: int
+    estimated_bytes: int
+
+
+def estimate_release_bytes(release: dict) -> int:
+    """
+    Roughly estimate the serialized size of the sound recordings of
+    release: a fixed amount of markup per track plus the text it holds.
+    """
+    size = 0
+    for track in release['sound_recordings']:
+        size += SHARD_TRACK_BYTES
+        for value in track.values():
+            if isinstance(value, str):
+                size += len(value)
+            elif isinstance(value, list):
+                size += sum(len(name) for name in value)
+    return size
+
+
+def shard_releases(releases, max_tracks: int = SHARD_MAX_TRACKS, max_bytes: int = SHARD_MAX_BYTES):
+    """
+    Yield Shards of releases holding at most max_tracks sound recordings and
+    about max_bytes of them, either limit being optional. A release that is
+    over a limit on its own still gets a shard of its own.
+    """
+    batch, tracks, size, index = [], 0, 0, 0
+    for release in releases:
+        release_tracks = len(release['sound_recordings'])
+        release_size = estimate_release_bytes(release) if max_bytes else 0
+        if batch and ((max_tracks and tracks + release_tracks > max_tracks)
+                      or (max_bytes and size + release_size > max_bytes)):
+            yield Shard(index, batch, tracks, size)
+            batch, tracks, size, index = [], 0, 0, index + 1
+        if (max_tracks and release_tracks > max_tracks) or (max_bytes and release_size > max_bytes):
+            logger.warning('A release of %s tracks is over the shard limits on its own.', release_tracks)
+        batch.append(release)
+        tracks += release_tracks
+        size += release_size
+    if batch:
+        yield Shard(index, batch, tracks, size)
+
+
+def build_shard(shard: Shard, output_path: str, thread_id: str, deterministic: bool,
+                created_datetime, pretty_print: bool) -> BuildResult:
+    """Build and write one shard. Runs in a worker process."""
+    try:
+        message_id = content_id('MessageId', thread_id, shard.index) if deterministic else None
+        root = build_message(shard.releases,
+                             deterministic=deterministic,
+                             created_datetime=created_datetime,
+                             thread_id=thread_id,
+                             message_id=message_id)
+        Sink(output_path, pretty_print=pretty_print).write(root)
+        return BuildResult(output_path, os.path.getsize(output_path), None)
+    except Exception as error:
+        logger.error('Failed to build shard %s: %r', shard.index, error)
+        return BuildResult(output_path, None, error)
+
+
+def build_shards(releases,
+                 output_dir: str = TEST_XML_DIR,
+                 prefix: str = 'message',
+                 max_tracks: int = SHARD_MAX_TRACKS,
+                 max_bytes: int = SHARD_MAX_BYTES,
+                 workers: int = None,
+                 deterministic: bool = False,
+                 created_datetime: datetime = None,
+                 pretty_print: bool = True,
+                 ) -> List[BuildResult]:
+    """
+    Shard releases and build every shard into output_dir as
+    <prefix>-<index>.xml, in a pool of worker processes.
+
+    Results are returned in shard order. A shard that fails is reported in
+    its BuildResult and does not stop the others.
+    """
+    created_datetime = created_datetime or datetime.now()
+    if deterministic:
+        thread_id = content_id('MessageThreadId', prefix, created_datetime.isoformat())
+    else:
+        thread_id = str(uuid())
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+                executor.submit(build_shard,
+                                shard,
+                                os.path.join(output_dir, f'{prefix}-{shard.index:04d}.xml'),
+                                thread_id,
+                                deterministic,
+                                created_datetime,
+                                pretty_print)
+                for shard in shard_releases(releases, max_tracks, max_bytes)
+                ]
+        results = [future.result() for future in futures]
+    logger.info('Built %s shards of thread %s.', len(results), thread_id)
+    return results
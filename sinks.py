@@ -0,0 +1,143 @@
+"""
+Output sinks for built messages.
+
+A Sink writes to a path or a binary file-like object, optionally through
+streaming gzip or zstd compression, pretty printed or compact. Paths are
+written through a large buffer to a temporary file next to the target,
+which is renamed over it only once it is complete, so watchers of the
+output directory never see a half-written message.
+"""
+import gzip
+import importlib.util
+import logging
+import os
+import secrets
+from contextlib import contextmanager
+
+from lxml import etree as et
+
+#  local imports
+from pydex.config import SINK_BUFFER_SIZE, SINK_COMPRESSION_LEVEL
+from pydex.metrics import metrics
+
+#  utils saves through a Sink, so this module cannot import from it.
+logger = logging.getLogger(__name__)
+
+#  File name suffix -> compression, used when compression is 'auto'.
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+
+def create_temp_file(directory: str, name: str):
+    """
+    Create a new file named after name in directory and return its
+    descriptor and path. Unlike tempfile.mkstemp the file is created with
+    the permissions open() would give it, i.e. 0o666 less the umask.
+    """
+    while True:
+        temp_path = os.path.join(directory, f'.{name}.{secrets.token_hex(4)}.tmp')
+        try:
+            return os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), temp_path
+        except FileExistsError:
+            continue
+
+
+class Sink:
+    """
+    Where a message is written to.
+
+    target is a path or a binary file-like object, which is written to as
+    is and left open. compression is None, 'gzip', 'zstd' (needs the
+    zstandard package) or 'auto' to pick it from the suffix of a target
+    path. Compressed output does not record a timestamp, so identical
+    messages compress to identical bytes.
+    """
+
+    def __init__(self,
+                 target,
+                 compression: str = 'auto',
+                 pretty_print: bool = False,
+                 buffer_size: int = SINK_BUFFER_SIZE,
+                 level: int = SINK_COMPRESSION_LEVEL,
+                 fsync: bool = True,
+                 ):
+        self.target = target
+        self.is_path = isinstance(target, (str, os.PathLike))
+        if compression == 'auto':
+            suffix = os.path.splitext(target)[1] if self.is_path else ''
+            compression = COMPRESSION_SUFFIXES.get(suffix)
+        if compression not in (None, 'gzip', 'zstd'):
+            raise ValueError(f'Unknown compression {compression!r}')
+        if compression == 'zstd' and importlib.util.find_spec('zstandard') is None:
+            raise ImportError('zstd compression needs the zstandard package, install it with '
+                              '`pip install zstandard` or write .gz instead')
+        self.compression = compression
+        self.pretty_print = pretty_print
+        self.buffer_size = buffer_size
+        self.level = level
+        self.fsync = fsync
+
+    @contextmanager
+    def open(self):
+        """
+        Yield a binary file object writing to the target. For a path the
+        target is only replaced if the with block completes.
+        """
+        if not self.is_path:
+            with self.compress(self.target) as output:
+                yield output
+            return
+
+        directory, name = os.path.split(os.path.abspath(self.target))
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temp_path = create_temp_file(directory, name)
+        try:
+            with open(descriptor, 'wb', buffering=self.buffer_size) as raw:
+                with self.compress(raw) as output:
+                    yield output
+                raw.flush()
+                if self.fsync:
+                    os.fsync(raw.fileno())
+            os.replace(temp_path, self.target)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        logger.debug('Wrote %s', self.target)
+
+    @contextmanager
+    def compress(self, raw):
+        """Yield a file object compressing into raw, or raw itself."""
+        if self.compression == 'gzip':
+            with gzip.GzipFile(filename='', mode='wb', fileobj=raw,
+                               compresslevel=self.level, mtime=0) as output:
+                yield output
+        elif self.compression == 'zstd':
+            import zstandard
+            compressor = zstandard.ZstdCompressor(level=self.level)
+            with compressor.stream_writer(raw, closefd=False) as output:
+                yield output
+        else:
+            yield raw
+
+    def write(self, element: et.Element):
+        """Serialize element with an XML declaration into the target."""
+        with metrics.span('sink.write', compression=self.compression or 'none'), self.open() as output:
+            et.ElementTree(element).write(output,
+                                          pretty_print=self.pretty_print,
+                                          xml_declaration=True,
+                                          encoding='UTF-8')
+
+    def write_bytes(self, data: bytes):
+        """Write already serialized data into the target."""
+        with metrics.span('sink.write', compression=self.compression or 'none'), self.open() as output:
+            output.write(data)
+
+    @contextmanager
+    def xmlfile(self):
+        """
+        Yield an lxml xmlfile writing into the target, with the XML
+        declaration already written, for streamed builds such as
+        ResourceList.write_into.
+        """
+        with self.open() as output, et.xmlfile(output, encoding='utf-8') as xf:
+            xf.write_declaration()
+            yield xf
@@ -0,0 +1,90 @@
+"""
+Columnar catalog input.
+
+Catalog exports come as CSV files or columnar data. read_table turns any of
+them into a dict mapping column names to lists, so the bulk builders can
+work a column at a time instead of a row at a time.
+
+Columns are named after the fields of a sound recording in a release
+description (see validation). The artists and contributors columns hold
+several names joined with TABLE_LIST_SEPARATOR.
+"""
+import csv
+import io
+import os
+
+#  local imports
+from pydex.utils import get_logger
+from pydex.config import TABLE_LIST_SEPARATOR
+
+logger = get_logger(__name__)
+
+LIST_COLUMNS = ('artists', 'contributors')
+OPTIONAL_COLUMNS = ('pline_company', 'pline_year')
+
+
+def read_csv(source) -> dict:
+    """Read a CSV path or text file object with a header row into columns."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline='', encoding='utf-8') as data:
+            return read_csv(data)
+    reader = csv.reader(source)
+    header = next(reader, None)
+    if header is None:
+        return {}
+    rows = []
+    for row in reader:
+        if len(row) != len(header):
+            #  zip would silently cut every column to the shortest row.
+            raise ValueError(f'CSV line {reader.line_num} has {len(row)} values, '
+                             f'expected {len(header)}')
+        rows.append(row)
+    #  Transpose once in C instead of building a dict per row.
+    columns = list(zip(*rows)) or [()] * len(header)
+    return {name: list(column) for name, column in zip(header, columns)}
+
+
+def read_table(table) -> dict:
+    """
+    Return table as a dict of equally long column lists.
+
+    table can be a dict of sequences (lists, tuples or NumPy arrays), a
+    NumPy structured array, or a CSV given as a path or text file object.
+    List columns are split into lists of names and empty optional values
+    become None.
+    """
+    if isinstance(table, (str, os.PathLike, io.IOBase)):
+        columns = read_csv(table)
+    elif getattr(getattr(table, 'dtype', None), 'names', None):
+        #  NumPy structured array, numpy itself is not needed to read it.
+        columns = {name: table[name].tolist() for name in table.dtype.names}
+    elif isinstance(table, dict):
+        columns = {name: column.tolist() if hasattr(column, 'tolist') else list(column)
+                   for name, column in table.items()}
+    else:
+        raise TypeError(f'Cannot read a table from {type(table).__name__}')
+
+    lengths = {len(column) for column in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f'Columns have different lengths: {sorted(lengths)}')
+    for name in LIST_COLUMNS:
+        if name in columns:
+            columns[name] = split_names(columns[name])
+    for name in OPTIONAL_COLUMNS:
+        if name in columns:
+            columns[name] = [value if value not in ('', None) else None for value in columns[name]]
+    logger.debug('Read table with %s rows and columns %s', lengths.pop() if lengths else 0, list(columns))
+    return columns
+
+
+def split_names(column) -> list:
+    """
+    Split every joined value of column into a list of stripped names.
+    Values that already are sequences of names are kept as lists.
+    """
+    separator = TABLE_LIST_SEPARATOR
+    return [
+            ([name.strip() for name in value.split(separator)] if value.strip() else [])
+            if isinstance(value, str) else list(value or ())
+            for value in column
+            ]
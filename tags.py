@@ -14,11 +14,15 @@ from enum import Enum, EnumMeta
 
 class MetaEnum(EnumMeta):
     def __contains__(cls, item):
+        #  Look the value up in the map Enum already keeps instead of
+        #  constructing a member and catching ValueError.
+        if isinstance(item, cls):
+            return True
         try:
-            cls(item)
-        except ValueError:
+            return item in cls._value2member_map_
+        except TypeError:
+            #  Unhashable values can never be members.
             return False
-        return True
 
 #  Type Sets
 class MessageControlType(Enum, metaclass=MetaEnum):
@@ -66,6 +70,13 @@ class ImageType(Enum, metaclass=MetaEnum):
 
 
 #  Tag Sets
+class MessageTags(Enum):
+    root = "NewReleaseMessage"
+    namespace = "http://ddex.net/xml/ern/411"
+    prefix = "ern"
+    language_and_script_code = "LanguageAndScriptCode"
+
+
 class MessageHeaderTags(Enum):
     root = "MessageHeader"
     thread_id = "MessageThreadId"
@@ -110,6 +121,10 @@ class SoundRecordingTags(Enum):
     pline_year = "PLineYear"
     duration = "Duration"
     parental_warning_type = "ParentalWarningType"
+    display_artist = "DisplayArtist"
+    artist_party_reference = "ArtistPartyReference"
+    contributor = "Contributor"
+    contributor_party_reference = "ContributorPartyReference"
 
 
 class TechnicalDetailsTags(Enum):
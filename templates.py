@@ -0,0 +1,49 @@
+"""
+Precompiled element templates for fixed shape sections.
+
+Sections such as Party or PLine always have the same elements, only their
+text changes. An ElementTemplate builds that skeleton once; each use is a
+C level deepcopy of it plus filling in the text slots, instead of looking
+up every tag and creating every element again.
+"""
+from copy import deepcopy
+
+from lxml import etree as et
+
+
+class ElementTemplate:
+    """
+    A fixed shape element compiled once and cloned for every use.
+
+    Each child is either a tag name, which becomes a leaf element holding a
+    text slot, or a tuple (tag, *children) for a nested element. fill()
+    takes the slot texts in document order.
+
+        party = ElementTemplate('Party', 'PartyReference', ('PartyName', 'FullName'))
+        party.fill('P1', 'Jane Doe')
+    """
+
+    def __init__(self, tag: str, *children):
+        self.skeleton = et.Element(tag)
+        #  Child index path from the root to every slot, in document order.
+        self.slots = []
+        self.compile(self.skeleton, children, ())
+
+    def compile(self, parent, children, path):
+        for index, child in enumerate(children):
+            if isinstance(child, str):
+                et.SubElement(parent, child)
+                self.slots.append(path + (index,))
+            else:
+                tag, *grandchildren = child
+                self.compile(et.SubElement(parent, tag), grandchildren, path + (index,))
+
+    def fill(self, *texts) -> et.Element:
+        """Return a new element with the slots set to texts."""
+        element = deepcopy(self.skeleton)
+        for path, text in zip(self.slots, texts):
+            node = element
+            for index in path:
+                node = node[index]
+            node.text = text
+        return element
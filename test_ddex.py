@@ -10,19 +10,43 @@ from lxml import etree as et
 #  local imports
 import pytest
 import re
+import copy
+import csv
+import gzip
+import io
+import json
+import logging
+import socket
+import struct
+import subprocess
+import threading
+import wave
+from http.client import HTTPConnection
 from uuid import uuid4 as uuid
-from pydex.utils import add_subelement_with_text, get_logger, format_duration
-from pydex.config import LOG_DIR, TEST_XML_DIR, FIXTURES_DIR
+from datetime import datetime
+from pydex.utils import (add_subelement_with_text,
+                         get_logger,
+                         format_duration,
+                         configure_logging,
+                         stop_logging,
+                         package_logger,
+                         content_id,
+                         save,
+                         )
+from pydex.config import LOG_DIR, TEST_XML_DIR, FIXTURES_DIR, IMPORT_TIME_BUDGET
 from pydex.tags import (MessagePartyTags,
                         MessageControlType,
                         MessageHeaderTags,
                         MessagePartyType,
                         ResourceListTags,
+                        MessageTags,
+                        SoundRecordingTags,
                         TechnicalDetailsTags,
                         TechnicalDetailsType,
                         SoundRecordingType,
                         ParentalWarningType,
                         PartyType,
+                        PartyListTags,
                         ImageTags,
                         ImageType,
                         )
@@ -32,10 +56,35 @@ from pydex.resource_builder import (ResourceList,
                                     SoundRecording,
                                     ImageRl
                                     )
-from pydex.party import Party
-
-
-logger = get_logger(__name__, 'tests')
+from pydex.party import Party, PartyRegistry
+from pydex.exceptions import ProbeError
+from pydex.cache import ProbeCache, FragmentCache
+from pydex.probe import (probe_audio,
+                         probe_image,
+                         read_audio_header,
+                         read_image,
+                         read_image_header,
+                         )
+from pydex.hashing import hash_file, hash_files
+from pydex.pipeline import BuildJob, BuildPipeline
+from pydex.metrics import Metrics, metrics
+from pydex.benchmark import run_benchmark, write_mp3, measure_import_time
+from pydex.templates import ElementTemplate
+from pydex.validation import validate_releases, validate_table
+from pydex.table import read_table
+from pydex.release import build_message
+from pydex.sinks import Sink
+from pydex.reader import read_message
+from pydex.diff import diff_messages, index_message, Change
+from pydex.schema import load_schema, validate_element, validate_file, assert_valid, validate_many
+from pydex.sharding import shard_releases, build_shards
+from pydex.exceptions import ValidationError, SchemaValidationError
+from pydex.server import BuildServer
+from pydex.manifest import read_manifest, iter_manifest, build_manifest, ManifestLineError, RELEASE_COLUMNS
+from pydex.__main__ import main as pydex_main
+
+
+logger = get_logger(__name__)
 
 
 #  fixtures
@@ -138,6 +187,77 @@ def fixture_resourcelist(soundrecording, image):
             )
 
 
+@pytest.fixture(name='wav_file')
+def fixture_wav_file(tmp_path):
+    """Writes a short silent stereo wav file, so audio tests do not depend
+    on resources that are not shipped with the repository."""
+    path = tmp_path / "audio.wav"
+    with wave.open(str(path), 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(b'\x00\x00' * 2 * 44100 * 3)
+    return str(path)
+
+
+@pytest.fixture(name='technicaldetails_wav')
+def fixture_technicaldetails_wav(wav_file):
+    return TechnicalDetails(
+            type_=TechnicalDetailsType.audio.value,
+            file=wav_file,
+            resource_uuid=str(uuid()),
+            sender_id="PAPI9012849",
+            )
+
+
+@pytest.fixture(name='soundrecording_wav')
+def fixture_soundrecording_wav(technicaldetails_wav, parties, contributors):
+    return SoundRecording(
+            type_=SoundRecordingType.musical_work_sound_recording.value,
+            id_="123456789",
+            song_name="Test Song",
+            artist_name='Test Artist',
+            pline_text="2023 Record Label",
+            parental_warning_type=ParentalWarningType.non_explicit.value,
+            technical_details=technicaldetails_wav,
+            party=parties,
+            contributor=contributors,
+            )
+
+
+@pytest.fixture(name='resourcelist_wav')
+def fixture_resourcelist_wav(soundrecording_wav, image):
+    return ResourceList(
+            sound_recording=[soundrecording_wav],
+            image=image
+            )
+
+
+@pytest.fixture(name='release_description')
+def fixture_release_description(wav_file):
+    return {
+            'message_control_type': MessageControlType.test.value,
+            'sender': {'party_id': 'PADPIDA2015010310U', 'full_name': 'Test Sender'},
+            'receiver': {'party_id': 'PADPIDA2016091404E', 'full_name': 'Test Receiver'},
+            'image': {'file': './resources/image.jpg',
+                      'type': ImageType.front_cover_image.value,
+                      'resource_reference': 'A0',
+                      'id_value': '123456789'},
+            'sound_recordings': [
+                {'type': SoundRecordingType.musical_work_sound_recording.value,
+                 'isrc': f'QZABC230000{i}',
+                 'song_name': f'Test Song {i}',
+                 'artist_name': 'Test Artist',
+                 'pline_text': '2023 Record Label',
+                 'parental_warning_type': ParentalWarningType.non_explicit.value,
+                 'file': wav_file,
+                 'artists': ['Test Artist'],
+                 'contributors': ['Test Contributor 0', 'Test Contributor 1']}
+                for i in range(3)
+                ],
+            }
+
+
 class TestUtils:
     """Test suite for utils module functions"""
     def test_add_subelement_with_text(self):
@@ -164,6 +284,54 @@ class TestUtils:
         assert re.match(expression, format_duration(duration))
 
 
+class TestLogging:
+    def test_debug_is_disabled_by_default(self):
+        assert not get_logger(f"{package_logger.name}.resource_builder").isEnabledFor(logging.DEBUG)
+
+    def test_configure_logging_routes_through_listener(self):
+        records = []
+
+        class ListHandler(logging.Handler):
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        configure_logging(level=logging.DEBUG, handler=ListHandler())
+        try:
+            get_logger(f"{package_logger.name}.tests").debug('Built %s tracks', 3)
+        finally:
+            stop_logging()
+        assert records == ['Built 3 tracks']
+        assert not any(isinstance(handler, logging.handlers.QueueHandler)
+                       for handler in package_logger.handlers)
+
+
+class TestElementTemplate:
+    def test_fill_sets_slots_in_document_order(self):
+        template = ElementTemplate('Party', 'PartyReference', ('PartyName', 'FullName'))
+        element = template.fill('P1', 'Jane Doe')
+        assert et.tostring(element) == (b'<Party><PartyReference>P1</PartyReference>'
+                                        b'<PartyName><FullName>Jane Doe</FullName></PartyName></Party>')
+
+    def test_fill_returns_independent_copies(self):
+        template = ElementTemplate('DisplayTitle', 'TitleText')
+        first, second = template.fill('One'), template.fill('Two')
+        assert (first[0].text, second[0].text) == ('One', 'Two')
+        assert template.skeleton[0].text is None
+
+    @pytest.mark.parametrize('company, year', [(None, None), ('Label', None), (None, '2023'), ('Label', '2023')])
+    def test_pline_template_variants(self, soundrecording_wav, company, year):
+        soundrecording_wav.pline_company = company
+        soundrecording_wav.pline_year = year
+        tag = soundrecording_wav.build_pline()
+        expected = [SoundRecordingTags.pline_text.value]
+        if company:
+            expected.append(SoundRecordingTags.pline_company.value)
+        if year:
+            expected.append(SoundRecordingTags.pline_year.value)
+        assert [children.tag for children in tag] == expected
+        assert [children.text for children in tag] == [text for text in ("2023 Record Label", company, year) if text]
+
+
 class TestMessageParty:
     """Test suite for every part of MessageParty section of DDEX xml file"""
     def test_message_party_sender_tag(self):
@@ -270,6 +438,31 @@ class TestResourceList:
         assert correct_order == root_order
 
 
+class TestResourceListStream:
+    def test_resource_list_rejects_non_iterable(self, image):
+        with pytest.raises(TypeError):
+            ResourceList(sound_recording=None, image=image)
+
+    def test_resource_list_write_stream_from_generator(self, soundrecording_wav, image):
+        logger.debug('Testing ResourceList streams a generator of sound recordings.')
+        resourcelist = ResourceList(
+                sound_recording=(soundrecording_wav for _ in range(5)),
+                image=image,
+                )
+        output = io.BytesIO()
+        assert resourcelist.write_stream(output) == 5
+        root = et.fromstring(output.getvalue())
+        root_order = [children.tag for children in root.getchildren()]
+        assert root.tag == ResourceListTags.root.value
+        assert root_order == [ResourceListTags.sound_recording.value] * 5 + [ResourceListTags.image.value]
+
+    def test_resource_list_write_stream_matches_write(self, soundrecording_wav, image):
+        streamed = io.BytesIO()
+        ResourceList(sound_recording=[soundrecording_wav], image=image).write_stream(streamed)
+        built = ResourceList(sound_recording=[soundrecording_wav], image=image).write()
+        assert et.tostring(et.fromstring(streamed.getvalue())) == et.tostring(built)
+
+
 class TestTechnicalDetails:
     def test_technical_details_root(self):
         assert TechnicalDetailsTags.root.value == "TechnicalDetails"
@@ -365,6 +558,1033 @@ class TestTechnicalDetails:
         assert correct_order == root_order
 
 
+class TestTechnicalDetailsBatch:
+    def test_from_files_keeps_input_order(self, wav_file, tmp_path):
+        missing = str(tmp_path / "missing.wav")
+        results = TechnicalDetails.from_files([wav_file, missing, wav_file],
+                                              workers=2,
+                                              sender_id="PAPI9012849")
+        assert [type(result) for result in results] == [TechnicalDetails, ProbeError, TechnicalDetails]
+        assert results[1].file == missing
+
+    def test_from_files_matches_single_probe(self, wav_file, technicaldetails_wav):
+        result, = TechnicalDetails.from_files([wav_file],
+                                              resource_uuids=[technicaldetails_wav.resource_uuid],
+                                              workers=1,
+                                              sender_id="PAPI9012849")
+        assert et.tostring(result.write()) == et.tostring(technicaldetails_wav.write())
+
+
+class TestProbeCache:
+    def test_probe_cache_hit_returns_same_probe(self, wav_file, tmp_path):
+        cache = ProbeCache(cache_dir=str(tmp_path / "cache"))
+        first = probe_audio(wav_file, cache)
+        second = probe_audio(wav_file, cache)
+        assert first == second
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_probe_cache_misses_changed_file(self, wav_file, tmp_path):
+        cache = ProbeCache(cache_dir=str(tmp_path / "cache"))
+        probe_audio(wav_file, cache)
+        with open(wav_file, 'ab') as audio:
+            audio.write(b'\x00' * 4)
+        assert cache.get('audio', wav_file) is None
+
+    def write_unversioned_cache(self, cache_dir, kind, file, payload):
+        """Write a cache as it was before rows were versioned."""
+        import sqlite3
+        cache_dir.mkdir()
+        connection = sqlite3.connect(str(cache_dir / "probe.sqlite3"))
+        connection.execute('CREATE TABLE probe (path TEXT NOT NULL, kind TEXT NOT NULL, size INTEGER NOT NULL,'
+                           ' mtime_ns INTEGER NOT NULL, inode INTEGER NOT NULL, payload TEXT NOT NULL,'
+                           ' last_access REAL NOT NULL, PRIMARY KEY (path, kind))')
+        path, size, mtime_ns, inode = ProbeCache.identity(file)
+        connection.execute('INSERT INTO probe VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           (path, kind, size, mtime_ns, inode, json.dumps(payload), 0.0))
+        connection.commit()
+        connection.close()
+
+    def test_probe_cache_misses_rows_of_older_layout(self, wav_file, tmp_path):
+        #  Payload without digests and with the old HashSum.
+        self.write_unversioned_cache(tmp_path / "cache", 'audio', wav_file,
+                                     {'audio_codec': 'wav', 'hash_value': 'old'})
+        cache = ProbeCache(cache_dir=str(tmp_path / "cache"))
+        assert cache.get('audio', wav_file) is None
+        probe = probe_audio(wav_file, cache)
+        assert probe.hash_value == probe.digests['md5']
+        assert probe_audio(wav_file, cache) == probe
+        assert ProbeCache(cache_dir=str(tmp_path / "cache"), version=cache.version + 1).get('audio', wav_file) is None
+
+    def test_probe_cache_misses_image_rows_without_mode(self, tmp_path):
+        image_file = './resources/image.jpg'
+        self.write_unversioned_cache(tmp_path / "cache", 'image', image_file,
+                                     {'height': 1, 'width': 1, 'hash_value': 'old', 'digests': {}})
+        cache = ProbeCache(cache_dir=str(tmp_path / "cache"))
+        probe = probe_image(image_file, cache)
+        assert probe.mode is not None
+        assert probe_image(image_file, cache) == probe
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_probe_cache_evicts_least_recently_used(self, tmp_path):
+        cache = ProbeCache(cache_dir=str(tmp_path / "cache"), max_entries=2)
+        files = []
+        for i in range(3):
+            path = tmp_path / f"{i}.bin"
+            path.write_bytes(b'x')
+            files.append(str(path))
+            cache.put('image', str(path), {'index': i})
+        assert len(cache) == 2
+        assert cache.get('image', files[0]) is None
+
+    def test_probe_cache_stays_within_limits_over_many_puts(self, tmp_path):
+        cache = ProbeCache(cache_dir=str(tmp_path / "cache"), max_entries=50, max_bytes=1000)
+        path = tmp_path / "file.bin"
+        path.write_bytes(b'x')
+        for i in range(500):
+            cache.put(f'kind-{i}', str(path), {'index': i})
+            #  Replacing an entry must not count it twice.
+            cache.put(f'kind-{i}', str(path), {'index': i})
+        total = cache.connection.execute('SELECT SUM(LENGTH(payload)) FROM probe').fetchone()[0]
+        assert len(cache) == cache.count <= 50
+        assert total == cache.total <= 1000
+        assert cache.get('kind-499', str(path)) == {'index': 499}
+        assert cache.get('kind-0', str(path)) is None
+
+
+class TestFragmentCache:
+    def test_unchanged_fragments_are_spliced_from_cache(self, resourcelist_wav, tmp_path):
+        cache = FragmentCache(cache_dir=str(tmp_path / "cache"))
+        resourcelist_wav.sound_recording = list(resourcelist_wav.sound_recording)
+        resourcelist_wav.fragment_cache = cache
+        first = et.tostring(resourcelist_wav.write())
+        assert (cache.hits, cache.misses) == (0, 3)
+        second = et.tostring(resourcelist_wav.write())
+        assert first == second
+        assert (cache.hits, cache.misses) == (2, 3)
+
+    def test_changed_recording_reuses_technical_details(self, soundrecording_wav, tmp_path):
+        cache = FragmentCache(cache_dir=str(tmp_path / "cache"))
+        cache.build(soundrecording_wav, cache)
+        soundrecording_wav.song_name = "Renamed Song"
+        tag = cache.build(soundrecording_wav, cache)
+        assert tag.findtext(f"{SoundRecordingTags.display_title.value}/"
+                            f"{SoundRecordingTags.title_text.value}") == "Renamed Song"
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_fragments_of_another_format_version_are_not_spliced(self, soundrecording_wav, tmp_path):
+        cache = FragmentCache(cache_dir=str(tmp_path / "cache"))
+        cache.build(soundrecording_wav.technical_details)
+        newer = FragmentCache(cache_dir=str(tmp_path / "cache"), version=cache.version + 1)
+        newer.build(soundrecording_wav.technical_details)
+        assert (newer.hits, newer.misses) == (0, 1)
+        assert len(newer) == 2
+
+    def test_fragment_cache_evicts_least_recently_used(self, tmp_path):
+        cache = FragmentCache(cache_dir=str(tmp_path / "cache"), max_entries=2)
+        for i in range(3):
+            cache.put('SoundRecording', str(i), b'<SoundRecording/>')
+        assert len(cache) == 2
+        assert cache.get('SoundRecording', '0') is None
+
+    def test_fragment_cache_stays_within_limits_over_many_puts(self, tmp_path):
+        cache = FragmentCache(cache_dir=str(tmp_path / "cache"), max_entries=50, max_bytes=1000)
+        for i in range(500):
+            cache.put('SoundRecording', str(i), b'<SoundRecording/>' * (i % 5 + 1))
+        total = cache.connection.execute('SELECT SUM(LENGTH(payload)) FROM fragment').fetchone()[0]
+        assert len(cache) == cache.count <= 50
+        assert total == cache.total <= 1000
+        assert cache.get('SoundRecording', '499') is not None
+        assert cache.get('SoundRecording', '0') is None
+
+
+class TestHashing:
+    def test_hash_file_computes_all_digests_in_one_pass(self, wav_file):
+        import hashlib
+        with open(wav_file, 'rb') as audio:
+            data = audio.read()
+        digests = hash_file(wav_file, ('md5', 'sha256'), buffer_size=4096)
+        assert digests == {'md5': hashlib.md5(data).hexdigest(),
+                           'sha256': hashlib.sha256(data).hexdigest()}
+
+    def test_hash_files_reports_failures_in_place(self, wav_file, tmp_path):
+        results = hash_files([wav_file, str(tmp_path / "missing"), wav_file], workers=2)
+        assert results[0] == results[2]
+        assert isinstance(results[1], ProbeError)
+
+    def test_technical_details_hash_sum_is_file_md5(self, technicaldetails_wav):
+        root = technicaldetails_wav.write()
+        hash_sum_value = root.find(f"{TechnicalDetailsTags.file.value}/"
+                                   f"{TechnicalDetailsTags.hash_sum.value}/"
+                                   f"{TechnicalDetailsTags.hash_sum_value.value}")
+        assert hash_sum_value.text == hash_file(technicaldetails_wav.file)['md5']
+
+
+class TestImageProbe:
+    def test_read_image_header_jpeg(self):
+        from PIL import Image
+        with Image.open("./resources/image.jpg") as image:
+            expected = image.width, image.height, image.mode
+        assert read_image_header("./resources/image.jpg") == expected
+
+    @pytest.mark.parametrize('mode', ['L', 'RGB', 'RGBA', 'P'])
+    def test_read_image_header_png(self, tmp_path, mode):
+        from PIL import Image
+        path = str(tmp_path / "cover.png")
+        Image.new(mode, (31, 17)).save(path)
+        assert read_image_header(path) == (31, 17, mode)
+
+    def test_read_image_falls_back_to_pillow(self, tmp_path):
+        from PIL import Image
+        path = str(tmp_path / "cover.gif")
+        Image.new('P', (12, 7)).save(path)
+        assert read_image_header(path) is None
+        probe = read_image(path)
+        assert (probe.width, probe.height) == (12, 7)
+
+    def test_technical_details_image_dimensions(self, technicaldetails_image):
+        root = technicaldetails_image.write()
+        assert root.find(TechnicalDetailsTags.image_height.value).text == "640"
+        assert root.find(TechnicalDetailsTags.image_width.value).text == "640"
+
+
+def write_flac(path, sample_rate=48000, channels=2, bits_per_sample=24, seconds=10):
+    """Writes a FLAC STREAMINFO block followed by a picture block and filler audio."""
+    packed = (sample_rate << 44) | ((channels - 1) << 41) | ((bits_per_sample - 1) << 36) \
+        | (sample_rate * seconds)
+    streaminfo = struct.pack('>HH', 4096, 4096) + b'\x00' * 6 + struct.pack('>Q', packed) + b'\x00' * 16
+    picture = b'\x00' * 5000
+    with open(path, 'wb') as audio:
+        audio.write(b'fLaC')
+        audio.write(struct.pack('>I', len(streaminfo)) + streaminfo)
+        audio.write(struct.pack('>I', (1 << 31) | (6 << 24) | len(picture)) + picture)
+        audio.write(b'\x00' * 1000)
+
+
+class TestAudioProbe:
+    def test_read_audio_header_wave(self, wav_file):
+        header = read_audio_header(wav_file)
+        assert (header.channels, header.sample_rate, header.bits_per_sample) == (2, 44100, 16)
+        assert header.duration == 3.0
+
+    def test_read_audio_header_flac(self, tmp_path):
+        path = str(tmp_path / "audio.flac")
+        write_flac(path)
+        header = read_audio_header(path)
+        assert (header.channels, header.sample_rate, header.bits_per_sample) == (2, 48000, 24)
+        assert header.duration == 10.0
+        assert header.bitrate == 1000 * 8 / 10.0
+
+    def test_read_audio_header_flac_without_streaminfo(self, tmp_path):
+        path = tmp_path / "audio.flac"
+        padding = b'\x00' * 64
+        path.write_bytes(b'fLaC' + struct.pack('>I', (1 << 31) | (1 << 24) | len(padding)) + padding)
+        assert read_audio_header(str(path)) is None
+
+    def test_read_audio_header_mp3(self, tmp_path):
+        path = str(tmp_path / "audio.mp3")
+        write_mp3(path)
+        header = read_audio_header(path)
+        assert (header.channels, header.sample_rate, header.bitrate) == (2, 44100, 128000)
+        assert header.duration == 200 * 417 * 8 / 128000
+
+    def test_read_audio_header_matches_audio_metadata(self, wav_file):
+        import audio_metadata
+        metadata = audio_metadata.load(wav_file)['streaminfo']
+        header = read_audio_header(wav_file)
+        assert (header.channels, header.sample_rate, header.bitrate, header.duration) == \
+            (metadata.channels, metadata.sample_rate, metadata.bitrate, metadata.duration)
+
+    def test_read_audio_header_unknown_format(self, tmp_path):
+        import random
+        generator = random.Random(0)
+        sync = b'\xff\xfb\x90\x44'
+        for i in range(300):
+            #  Compressed payloads are full of bytes that look like frame syncs.
+            payload = bytearray(generator.randbytes(4096))
+            for _ in range(20):
+                offset = generator.randrange(len(payload) - 4)
+                payload[offset:offset + 4] = sync
+            for name, magic in ((f"audio{i}.ogg", b'OggS'), (f"audio{i}.m4a", b'\x00\x00\x00\x20ftypM4A ')):
+                path = tmp_path / name
+                path.write_bytes(magic + payload)
+                assert read_audio_header(str(path)) is None, name
+
+    def test_read_audio_header_needs_two_mpeg_frames(self, tmp_path):
+        path = str(tmp_path / "audio.mp3")
+        write_mp3(path, frames=1)
+        assert read_audio_header(path) is None
+
+
+class TestBuildPipeline:
+    def test_pipeline_builds_every_job(self, wav_file, image, parties, contributors, tmp_path):
+        def assemble(technical_details):
+            recordings = [
+                    SoundRecording(
+                        type_=SoundRecordingType.musical_work_sound_recording.value,
+                        id_=f"ISRC{i}",
+                        song_name=f"Song {i}",
+                        artist_name="Test Artist",
+                        pline_text="2023 Record Label",
+                        parental_warning_type=ParentalWarningType.non_explicit.value,
+                        technical_details=details,
+                        party=parties,
+                        contributor=contributors,
+                        )
+                    for i, details in enumerate(technical_details)
+                    ]
+            return ResourceList(sound_recording=recordings, image=image).write()
+
+        resource = {'type_': TechnicalDetailsType.audio.value,
+                    'file': wav_file,
+                    'resource_uuid': str(uuid()),
+                    'sender_id': "PAPI9012849"}
+        jobs = (BuildJob(f"message{i}.xml", [resource] * 3, assemble) for i in range(6))
+        pipeline = BuildPipeline(output_dir=str(tmp_path), queue_size=1, probe_concurrency=2)
+        results = pipeline.build(jobs)
+        assert len(results) == 6
+        assert all(result.error is None for result in results)
+        for result in results:
+            root = et.parse(result.output_filename).getroot()
+            assert len(root.findall(ResourceListTags.sound_recording.value)) == 3
+
+    def test_pipeline_reports_failed_job(self, image, tmp_path):
+        missing = {'type_': TechnicalDetailsType.audio.value,
+                   'file': str(tmp_path / "missing.wav"),
+                   'resource_uuid': str(uuid())}
+        ok = BuildJob("ok.xml", [], lambda details: image.write())
+        failing = BuildJob("failing.xml", [missing], lambda details: image.write())
+        results = BuildPipeline(output_dir=str(tmp_path)).build([failing, ok])
+        errors = {os.path.basename(result.output_filename): result.error for result in results}
+        assert isinstance(errors["failing.xml"], FileNotFoundError)
+        assert errors["ok.xml"] is None
+
+
+class TestMetrics:
+    def test_span_and_counter_aggregation(self):
+        recorder = Metrics()
+        for _ in range(3):
+            with recorder.span('hash', file='a.wav'):
+                pass
+        recorder.incr('hash.bytes', 10)
+        recorder.incr('hash.bytes', 5)
+        snapshot = recorder.snapshot()
+        assert snapshot['timings']['hash']['count'] == 3
+        assert snapshot['counters'] == {'hash.bytes': 15}
+
+    def test_hooks_receive_labels(self):
+        recorder = Metrics()
+        seen = []
+        recorder.add_hook(lambda kind, name, value, labels: seen.append((kind, name, value, labels)))
+        recorder.incr('cache.hit', file='a.wav')
+        assert seen == [('counter', 'cache.hit', 1, {'file': 'a.wav'})]
+
+    def test_disabled_metrics_record_nothing(self):
+        recorder = Metrics(enabled=False)
+        with recorder.span('hash'):
+            recorder.incr('hash.bytes', 10)
+        assert recorder.snapshot() == {'timings': {}, 'counters': {}}
+
+    def test_build_is_instrumented(self, resourcelist_wav):
+        metrics.reset()
+        resourcelist_wav.write()
+        snapshot = json.loads(metrics.to_json())
+        assert snapshot['timings']['build.sound_recording']['count'] == 1
+        assert snapshot['counters']['build.elements'] > 0
+
+
+class TestBenchmark:
+    def test_run_benchmark_writes_report(self, tmp_path):
+        report = run_benchmark(tracks=3, parties=2, contributors=2,
+                               workdir=str(tmp_path), output_dir=str(tmp_path / "bench"))
+        with open(report['output_file']) as output:
+            saved = json.load(output)
+        assert set(saved['results']) == {'MessageHeader', 'Party', 'TechnicalDetails',
+                                         'SoundRecording', 'ResourceList'}
+        assert saved['results']['SoundRecording']['items'] == 3
+        assert saved['results']['ResourceList']['output_bytes'] > 0
+        assert saved['memory']['bytes_per_track'] > 0
+        assert saved['peak_rss'] > 0
+        assert not any('peak_rss' in result for result in saved['results'].values())
+
+    def test_builder_objects_have_no_instance_dict(self, soundrecording_wav, sender, messageheader, image):
+        for builder in (soundrecording_wav, soundrecording_wav.technical_details,
+                        soundrecording_wav.party[0], sender, messageheader, image):
+            assert not hasattr(builder, '__dict__')
+
+    def test_run_benchmark_mp3_catalog(self, tmp_path):
+        report = run_benchmark(tracks=2, audio_format='mp3', workdir=str(tmp_path), output_dir=None)
+        assert report['results']['TechnicalDetails']['items'] == 2
+
+    def test_main_prints_empty_run_without_report(self, capsys):
+        from pydex.benchmark import main
+        main(['--tracks', '0', '--output-dir', ''])
+        out = capsys.readouterr().out
+        assert 'n/a ms/item' in out
+        assert 'Results written to' not in out
+
+
+class TestImport:
+    def test_import_time_is_within_budget(self):
+        report = measure_import_time('pydex.resource_builder')
+        assert report['seconds'] < IMPORT_TIME_BUDGET, report['slowest']
+
+    def test_import_is_lazy_and_side_effect_free(self, tmp_path):
+        #  Run from an empty directory, where ./docs does not exist.
+        code = ("import sys; path = list(sys.path); "
+                "import pydex.resource_builder, pydex.release, pydex.reader; "
+                "assert sys.path == path; "
+                "print(' '.join(name for name in ('audio_metadata', 'PIL', 'multiprocessing') "
+                "if name in sys.modules))")
+        env = dict(os.environ, PYTHONPATH=str(package_root_directory))
+        result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env,
+                                capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip() == ''
+        assert list(tmp_path.iterdir()) == []
+
+
+@pytest.fixture(name='catalog_columns')
+def fixture_catalog_columns(wav_file):
+    return {
+            'type': [SoundRecordingType.musical_work_sound_recording.value] * 3,
+            'isrc': [f'QZABC230000{i}' for i in range(3)],
+            'song_name': [f'Test Song {i}' for i in range(3)],
+            'artist_name': ['Test Artist'] * 3,
+            'pline_text': ['2023 Record Label'] * 3,
+            'parental_warning_type': [ParentalWarningType.non_explicit.value] * 3,
+            'file': [wav_file] * 3,
+            'artists': ['Test Artist|Guest Artist', 'Test Artist', ''],
+            'contributors': ['Test Contributor'] * 3,
+            'pline_company': ['', 'Record Label', ''],
+            }
+
+
+class TestFromTable:
+    def test_from_dict_of_columns(self, catalog_columns, image):
+        registry = PartyRegistry()
+        resource_list = ResourceList.from_table(catalog_columns, image, sender_id="PAPI9012849",
+                                                party_registry=registry, workers=1)
+        root = resource_list.write()
+        recordings = root.findall(ResourceListTags.sound_recording.value)
+        assert len(recordings) == 3
+        assert recordings[0].findtext(SoundRecordingTags.display_title_text.value) == "Test Artist - Test Song 0"
+        assert len(recordings[0].findall(SoundRecordingTags.display_artist.value)) == 2
+        assert recordings[2].find(SoundRecordingTags.display_artist.value) is None
+        assert recordings[1].findtext(f"{SoundRecordingTags.pline.value}/"
+                                      f"{SoundRecordingTags.pline_company.value}") == "Record Label"
+        assert len(registry) == 3
+
+    def test_from_csv_streams(self, catalog_columns, image, tmp_path):
+        path = tmp_path / "catalog.csv"
+        with open(path, 'w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(list(catalog_columns))
+            writer.writerows(zip(*catalog_columns.values()))
+        resource_list = ResourceList.from_table(str(path), image, sender_id="PAPI9012849", workers=1)
+        output = io.BytesIO()
+        assert resource_list.write_stream(output) == 3
+
+    def test_ragged_csv_row_is_rejected(self, catalog_columns, tmp_path):
+        path = tmp_path / "catalog.csv"
+        with open(path, 'w', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(list(catalog_columns))
+            rows = [list(row) for row in zip(*catalog_columns.values())]
+            rows[1].pop()
+            writer.writerows(rows)
+        with pytest.raises(ValueError, match='line 3'):
+            read_table(str(path))
+
+    def test_from_structured_array(self, catalog_columns, image):
+        numpy = pytest.importorskip('numpy')
+        array = numpy.array(list(zip(*catalog_columns.values())),
+                            dtype=[(name, 'U64') for name in catalog_columns])
+        resource_list = ResourceList.from_table(array, image, sender_id="PAPI9012849", workers=1)
+        assert len(resource_list.write().findall(ResourceListTags.sound_recording.value)) == 3
+
+    def test_invalid_table_reports_every_row(self, catalog_columns, image):
+        catalog_columns['parental_warning_type'][1] = 'Explicitt'
+        catalog_columns['isrc'][2] = catalog_columns['isrc'][0]
+        catalog_columns['song_name'][0] = ' '
+        report = validate_table(read_table(catalog_columns))
+        assert {(problem.location, problem.field) for problem in report.problems} == {
+                ('rows[1]', 'parental_warning_type'),
+                ('rows[2]', 'isrc'),
+                ('rows[0]', 'song_name'),
+                }
+        with pytest.raises(ValidationError):
+            ResourceList.from_table(catalog_columns, image, sender_id="PAPI9012849")
+
+    def test_non_string_table_values_are_reported(self, catalog_columns):
+        catalog_columns['type'][0] = 5
+        catalog_columns['parental_warning_type'][1] = b'NonExplicit'
+        catalog_columns['isrc'][2] = 12345
+        report = validate_table(read_table(catalog_columns))
+        assert {(problem.location, problem.field) for problem in report.problems} == {
+                ('rows[0]', 'type'),
+                ('rows[1]', 'parental_warning_type'),
+                ('rows[2]', 'isrc'),
+                }
+
+
+def make_releases(release_description, count, tracks=3):
+    releases = []
+    for index in range(count):
+        release = json.loads(json.dumps(release_description))
+        release['sound_recordings'] = [dict(release['sound_recordings'][0],
+                                            isrc=f'QZABC23{index:02d}{i:03d}')
+                                       for i in range(tracks)]
+        releases.append(release)
+    return releases
+
+
+class TestRelease:
+    def test_build_message(self, release_description):
+        root = build_message(release_description)
+        assert et.QName(root).localname == MessageTags.root.value
+        assert root.nsmap == {MessageTags.prefix.value: MessageTags.namespace.value}
+        assert [child.tag for child in root] == [MessageHeaderTags.root.value,
+                                                 PartyListTags.root.value,
+                                                 ResourceListTags.root.value]
+        assert len(root.find(PartyListTags.root.value)) == 3
+        assert len(root.findall(f"{ResourceListTags.root.value}/"
+                                f"{ResourceListTags.sound_recording.value}")) == 3
+
+    def test_releases_of_one_message_share_parties(self, release_description):
+        root = build_message(make_releases(release_description, 2))
+        assert len(root.find(PartyListTags.root.value)) == 3
+        assert len(root.findall(f"{ResourceListTags.root.value}/{ResourceListTags.image.value}")) == 2
+
+
+class TestSharding:
+    def test_shards_respect_track_limit_and_keep_releases_whole(self, release_description):
+        shards = list(shard_releases(make_releases(release_description, 5, tracks=3), max_tracks=7))
+        assert [shard.tracks for shard in shards] == [6, 6, 3]
+        assert [shard.index for shard in shards] == [0, 1, 2]
+
+    def test_shards_respect_byte_limit(self, release_description):
+        releases = make_releases(release_description, 4, tracks=2)
+        shards = list(shard_releases(releases, max_tracks=None, max_bytes=6000))
+        assert len(shards) == 2
+        assert all(shard.estimated_bytes <= 6000 for shard in shards)
+
+    def test_build_shards_share_thread_id(self, release_description, tmp_path):
+        results = build_shards(make_releases(release_description, 3), output_dir=str(tmp_path),
+                               max_tracks=3, workers=2, deterministic=True)
+        assert all(result.error is None for result in results)
+        headers = [et.parse(result.output_filename).getroot().find(MessageHeaderTags.root.value)
+                   for result in results]
+        assert len({header.findtext(MessageHeaderTags.thread_id.value) for header in headers}) == 1
+
+
+class TestSinks:
+    def test_compact_atomic_write(self, resourcelist_wav, tmp_path):
+        path = tmp_path / "out" / "message.xml"
+        Sink(str(path)).write(resourcelist_wav.write())
+        data = path.read_bytes()
+        assert data.startswith(b"<?xml")
+        assert b"\n  <" not in data
+        assert os.listdir(path.parent) == ["message.xml"]
+
+    def test_written_file_follows_umask(self, image, tmp_path):
+        previous = os.umask(0o027)
+        try:
+            path = tmp_path / "image.xml"
+            Sink(str(path)).write(image.write())
+        finally:
+            os.umask(previous)
+        assert path.stat().st_mode & 0o777 == 0o640
+
+    def test_zstd_without_zstandard_fails_clearly(self, tmp_path, monkeypatch):
+        import importlib.util
+        monkeypatch.setattr(importlib.util, 'find_spec', lambda name, *args: None)
+        with pytest.raises(ImportError, match='zstandard'):
+            Sink(str(tmp_path / "message.xml.zst"))
+
+    def test_gzip_is_picked_from_suffix_and_reproducible(self, image, tmp_path):
+        tag = image.write()
+        paths = [tmp_path / f"{i}" / "image.xml.gz" for i in range(2)]
+        for path in paths:
+            Sink(str(path), pretty_print=True).write(tag)
+        assert paths[0].read_bytes() == paths[1].read_bytes()
+        assert et.fromstring(gzip.decompress(paths[0].read_bytes())).tag == ImageTags.root.value
+
+    def test_failed_write_keeps_previous_file(self, tmp_path):
+        path = tmp_path / "message.xml"
+        path.write_bytes(b"previous")
+        with pytest.raises(RuntimeError):
+            with Sink(str(path)).open() as output:
+                output.write(b"half")
+                raise RuntimeError("interrupted")
+        assert path.read_bytes() == b"previous"
+        assert os.listdir(tmp_path) == ["message.xml"]
+
+    def test_stream_resource_list_into_file_object(self, resourcelist_wav):
+        output = io.BytesIO()
+        assert resourcelist_wav.write_stream(Sink(output, compression='gzip')) == 1
+        root = et.fromstring(gzip.decompress(output.getvalue()))
+        assert root.tag == ResourceListTags.root.value
+
+    def test_save_writes_into_output_dir(self, image, tmp_path):
+        save(image.write(), "image.xml", output_dir=str(tmp_path))
+        assert et.parse(str(tmp_path / "image.xml")).getroot().tag == ImageTags.root.value
+
+
+def detached(tag):
+    """Serialize tag without the namespace declarations of its ancestors."""
+    tag = copy.deepcopy(tag)
+    et.cleanup_namespaces(tag)
+    return et.tostring(tag)
+
+
+class TestReader:
+    def test_round_trip(self, release_description):
+        release_description['message_control_type'] = MessageControlType.live.value
+        root = build_message(make_releases(release_description, 2), deterministic=True,
+                             created_datetime=datetime(2023, 2, 10, 14, 26))
+        data = et.tostring(root)
+        registry = PartyRegistry()
+        objects = list(read_message(io.BytesIO(data), registry))
+        kinds = [type(item).__name__ for item in objects]
+        assert kinds == ['MessageHeader'] + ['Party'] * 3 + ['SoundRecording'] * 6 + ['ImageRl'] * 2
+
+        header, recordings = objects[0], objects[4:10]
+        assert et.tostring(header.write()) == detached(root.find(MessageHeaderTags.root.value))
+        written = root.findall(f"{ResourceListTags.root.value}/{ResourceListTags.sound_recording.value}")
+        for recording, tag in zip(recordings, written):
+            assert et.tostring(recording.write()) == detached(tag)
+        assert et.tostring(registry.write()) == detached(root.find(PartyListTags.root.value))
+        assert et.tostring(objects[-1].write()) == detached(written[0].getparent()[-1])
+
+    def test_reads_lone_fragments(self, sender, technicaldetails_image):
+        data = et.tostring(sender.write())
+        party, = read_message(io.BytesIO(data))
+        assert (party.party_id, party.full_name, party.role) == (sender.party_id, sender.full_name, sender.role)
+        details, = read_message(io.BytesIO(et.tostring(technicaldetails_image.write())))
+        assert et.tostring(details.write()) == et.tostring(technicaldetails_image.write())
+
+    def test_memory_stays_flat(self, soundrecording_wav):
+        import tracemalloc
+        tag = et.tostring(soundrecording_wav.write())
+        data = b"<ResourceList>" + tag * 1000 + b"</ResourceList>"
+
+        def peak(work):
+            tracemalloc.start()
+            try:
+                work()
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+        streamed = peak(lambda: sum(1 for _ in read_message(io.BytesIO(data))))
+        assert streamed < len(data) / 4
+
+
+class TestDiff:
+    def build(self, releases, pretty_print=False):
+        root = build_message(releases, deterministic=True, created_datetime=datetime(2023, 2, 10, 14, 26))
+        return io.BytesIO(et.tostring(root, pretty_print=pretty_print))
+
+    def test_identical_messages_have_no_changes(self, release_description):
+        releases = make_releases(release_description, 2)
+        diff = diff_messages(self.build(releases), self.build(releases, pretty_print=True))
+        assert not diff.has_changes
+        assert diff.unchanged == len(index_message(self.build(releases)))
+
+    def test_reports_added_removed_and_changed(self, release_description):
+        old = make_releases(release_description, 2)
+        new = json.loads(json.dumps(old))
+        new[0]['sound_recordings'][0]['song_name'] = 'Renamed Song'
+        removed = new[1]['sound_recordings'].pop()
+        new[1]['sound_recordings'].append(dict(removed, isrc='QZABC2399999'))
+        diff = diff_messages(self.build(old), self.build(new))
+        assert diff.added == [Change('SoundRecording', 'QZABC2399999'), Change('TechnicalDetails', 'QZABC2399999')]
+        assert diff.removed == [Change('SoundRecording', removed['isrc']), Change('TechnicalDetails', removed['isrc'])]
+        assert diff.changed == [Change('SoundRecording', old[0]['sound_recordings'][0]['isrc'])]
+
+    def test_ignored_tags(self, release_description):
+        releases = make_releases(release_description, 1)
+        first = build_message(releases)
+        second = build_message(releases)
+        assert diff_messages(io.BytesIO(et.tostring(first)), io.BytesIO(et.tostring(second))).changed
+        diff = diff_messages(io.BytesIO(et.tostring(first)), io.BytesIO(et.tostring(second)),
+                             ignore={TechnicalDetailsTags.details_reference.value})
+        #  Party references are still random.
+        assert {change.kind for change in diff.changed} == {'SoundRecording'}
+
+
+MESSAGE_HEADER_XSD = """<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">
+  <xs:complexType name="MessagePartyType">
+    <xs:sequence>
+      <xs:element name="PartyId" type="xs:string"/>
+      <xs:element name="PartyName">
+        <xs:complexType><xs:sequence><xs:element name="FullName" type="xs:string"/></xs:sequence></xs:complexType>
+      </xs:element>
+    </xs:sequence>
+  </xs:complexType>
+  <xs:element name="MessageHeader">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="MessageThreadId" type="xs:string"/>
+        <xs:element name="MessageId" type="xs:string"/>
+        <xs:element name="MessageSender" type="MessagePartyType"/>
+        <xs:element name="MessageRecipient" type="MessagePartyType"/>
+        <xs:element name="MessageCreatedDateTime" type="xs:dateTime"/>
+        <xs:element name="MessageControlType" type="xs:string"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+"""
+
+
+@pytest.fixture(name='schema_file')
+def fixture_schema_file(tmp_path):
+    path = tmp_path / "messageheader.xsd"
+    path.write_text(MESSAGE_HEADER_XSD)
+    return str(path)
+
+
+class TestSchema:
+    def test_schema_is_compiled_once(self, schema_file):
+        assert load_schema(schema_file) is load_schema(schema_file)
+
+    def test_schema_is_compiled_once_however_it_is_located(self, messageheader, schema_file, tmp_path,
+                                                           monkeypatch):
+        import pydex.schema
+        monkeypatch.setattr(pydex.schema, 'schema_path', lambda: schema_file)
+        message = tmp_path / "message.xml"
+        message.write_bytes(et.tostring(messageheader.write()))
+        pydex.schema._compile_schema.cache_clear()
+        assert validate_element(messageheader.write()) == []
+        assert validate_file(str(message)).ok
+        assert validate_file(str(message), os.path.relpath(schema_file)).ok
+        assert pydex.schema._compile_schema.cache_info().misses == 1
+
+    def test_validate_element_directly(self, messageheader, schema_file):
+        tag = messageheader.write()
+        assert validate_element(tag, load_schema(schema_file)) == []
+        tag.remove(tag.find(MessageHeaderTags.message_id.value))
+        problems = validate_element(tag, load_schema(schema_file))
+        assert len(problems) == 1
+        assert problems[0].path == "/MessageHeader/MessageSender"
+        with pytest.raises(SchemaValidationError):
+            assert_valid(tag, load_schema(schema_file))
+
+    def test_validate_many(self, messageheader, schema_file, tmp_path):
+        valid = tmp_path / "valid.xml"
+        valid.write_bytes(et.tostring(messageheader.write()))
+        invalid = tmp_path / "invalid.xml"
+        invalid.write_bytes(b"<MessageHeader><MessageId/></MessageHeader>")
+        broken = tmp_path / "broken.xml"
+        broken.write_bytes(b"<MessageHeader>")
+        results = validate_many([str(valid), str(invalid), str(broken)], schema_file, workers=2)
+        assert [result.ok for result in results] == [True, False, False]
+        assert results[1].problems[0].line == 1
+        assert results[2].problems[0].type == 'XMLSyntaxError'
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost')
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+class TestServer:
+    @pytest.fixture(name='server')
+    def fixture_server(self, tmp_path):
+        server = BuildServer(port=0, workers=1, max_pending=2, output_dir=str(tmp_path),
+                             cache_dir=str(tmp_path / 'cache'))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+
+    def post(self, connection, release, path='/build'):
+        connection.request('POST', path, body=json.dumps(release),
+                           headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, response.read()
+
+    def test_build_returns_message(self, server, release_description):
+        connection = HTTPConnection(*server.address)
+        status, body = self.post(connection, release_description)
+        assert status == 200
+        root = et.fromstring(body)
+        assert et.QName(root).localname == MessageTags.root.value
+        assert len(root.findall(f'.//{ResourceListTags.sound_recording.value}')) == 3
+        #  The connection is kept alive between builds.
+        status, _ = self.post(connection, release_description)
+        assert status == 200
+
+    def test_build_writes_output(self, server, release_description, tmp_path):
+        status, body = self.post(HTTPConnection(*server.address), release_description,
+                                 '/build?output=../message.xml')
+        assert status == 200
+        assert json.loads(body)['output'] == str(tmp_path / 'message.xml')
+        assert et.parse(str(tmp_path / 'message.xml')).getroot() is not None
+
+    def test_invalid_release_is_rejected(self, server, release_description):
+        release_description['sound_recordings'][0]['isrc'] = 'QZ-ABC'
+        status, body = self.post(HTTPConnection(*server.address), release_description)
+        assert status == 400
+        assert json.loads(body)['problems'][0]['field'] == 'isrc'
+        status, _ = self.post(HTTPConnection(*server.address), [release_description])
+        assert status == 400
+
+    def test_malformed_release_is_rejected(self, server, release_description):
+        release_description['sound_recordings'][0] = 5
+        status, body = self.post(HTTPConnection(*server.address), release_description)
+        assert status == 400
+        assert json.loads(body)['problems'][0]['location'] == 'releases[0].sound_recordings[0]'
+
+    def test_timed_out_build_keeps_its_slot(self, release_description, tmp_path):
+        import time
+        server = BuildServer(port=0, workers=1, max_pending=1, timeout=0.05, cache_dir=None)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            #  Keep the only worker busy so the build queues behind it.
+            busy = server.executor.submit(time.sleep, 1)
+            status, _ = self.post(HTTPConnection(*server.address), release_description)
+            assert status == 504
+            status, _ = self.post(HTTPConnection(*server.address), release_description)
+            assert status == 503
+            busy.result()
+            deadline = time.monotonic() + 10
+            while not server.pending.acquire(blocking=False):
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+            server.pending.release()
+        finally:
+            server.shutdown()
+
+    def test_full_queue_is_rejected(self, server, release_description):
+        for _ in range(server.max_pending):
+            server.pending.acquire()
+        status, _ = self.post(HTTPConnection(*server.address), release_description)
+        assert status == 503
+        for _ in range(server.max_pending):
+            server.pending.release()
+
+    def test_unix_socket(self, release_description, tmp_path):
+        path = str(tmp_path / 'pydex.sock')
+        server = BuildServer(unix_socket=path, workers=1, cache_dir=None)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            status, body = self.post(UnixHTTPConnection(path), release_description)
+            assert status == 200
+            assert et.QName(et.fromstring(body)).localname == MessageTags.root.value
+        finally:
+            server.shutdown()
+        assert not os.path.exists(path)
+
+
+class TestManifest:
+    def write_jsonl(self, path, releases):
+        path.write_text(''.join(json.dumps(release) + '\n' for release in releases))
+        return str(path)
+
+    def test_build_jsonl_manifest(self, release_description, tmp_path):
+        releases = make_releases(release_description, 3)
+        releases[1]['sound_recordings'][0]['isrc'] = releases[0]['sound_recordings'][0]['isrc']
+        manifest = self.write_jsonl(tmp_path / 'releases.jsonl', releases)
+        output_dir = tmp_path / 'out'
+        summary = build_manifest(manifest, str(output_dir), jobs=2, cache_dir=None)
+        assert (summary.messages, summary.tracks) == (2, 6)
+        assert summary.bytes_read > 0
+        assert summary.bytes_written == sum(path.stat().st_size for path in output_dir.iterdir())
+        failure, = summary.failures
+        assert failure.output_filename.endswith('message-000001.xml')
+        assert isinstance(failure.error, ValidationError)
+        assert sorted(path.name for path in output_dir.iterdir()) == ['message-000000.xml', 'message-000002.xml']
+
+    def test_malformed_lines_do_not_stop_the_batch(self, release_description, tmp_path):
+        first, second = (json.dumps(release) for release in make_releases(release_description, 2))
+        malformed = json.dumps(dict(release_description, sound_recordings=[5]))
+        path = tmp_path / 'releases.jsonl'
+        path.write_text('\n'.join([first, '{"sender": ', malformed, '', second]) + '\n')
+        summary = build_manifest(str(path), str(tmp_path / 'out'), jobs=1, cache_dir=None)
+        assert (summary.messages, summary.tracks) == (2, 6)
+        undecodable, invalid = summary.failures
+        assert isinstance(undecodable.error, ManifestLineError)
+        assert f'{path}:2:' in str(undecodable.error)
+        assert isinstance(invalid.error, ValidationError)
+        assert invalid.error.report.problems[0].location == f'{path}:3.sound_recordings[0]'
+        with pytest.raises(ValueError, match=':2:'):
+            list(read_manifest(str(path)))
+
+    def test_read_csv_manifest(self, release_description, tmp_path):
+        release = release_description
+        track_columns = list(release['sound_recordings'][0])
+        header = ['release', *RELEASE_COLUMNS, *track_columns]
+        path = tmp_path / 'releases.csv'
+        with open(path, 'w', newline='') as data:
+            writer = csv.writer(data)
+            writer.writerow(header)
+            for name in ('first', 'second'):
+                for track in release['sound_recordings']:
+                    values = {'release': name}
+                    for column, (part, field) in RELEASE_COLUMNS.items():
+                        values[column] = release[part][field]
+                    values.update({key: '|'.join(value) if isinstance(value, list) else value
+                                   for key, value in track.items()})
+                    writer.writerow([values[column] for column in header])
+        (first_line, first), (second_line, second) = iter_manifest(str(path))
+        assert (first_line, second_line) == (2, 5)
+        assert first['sender'] == release['sender']
+        assert first['image'] == release['image']
+        assert first['sound_recordings'] == release['sound_recordings']
+        assert len(second['sound_recordings']) == 3
+
+    def test_build_command(self, release_description, tmp_path, capsys):
+        manifest = self.write_jsonl(tmp_path / 'releases.jsonl', make_releases(release_description, 2))
+        status = pydex_main(['build', manifest, '--jobs', '1', '--output-dir', str(tmp_path / 'out'),
+                             '--cache-dir', ''])
+        assert status == 0
+        out = capsys.readouterr().out
+        assert 'Built 2 messages (6 tracks)' in out
+        assert 'messages/s' in out and 'tracks/s' in out and 'bytes read' in out
+
+
+class TestValidation:
+    def test_meta_enum_contains(self):
+        assert ImageType.front_cover_image.value in ImageType
+        assert ImageType.front_cover_image in ImageType
+        assert "FrontCover" not in ImageType
+        assert [] not in ImageType
+
+    def test_valid_release_has_no_problems(self, release_description):
+        report = validate_releases([release_description])
+        assert report.ok, str(report)
+
+    def test_every_problem_is_reported(self, release_description, tmp_path):
+        tracks = release_description['sound_recordings']
+        tracks[0]['type'] = 'MusicalWorkSoundRecordin'
+        tracks[1]['isrc'] = 'QZ-ABC'
+        tracks[2]['isrc'] = tracks[0]['isrc']
+        tracks[2]['parental_warning_type'] = 'Clean'
+        tracks[2]['file'] = str(tmp_path / 'missing.wav')
+        release_description['sender']['party_id'] = '123'
+        report = validate_releases([release_description, {'sound_recordings': []}])
+        fields = {(problem.location, problem.field) for problem in report.problems}
+        assert ('releases[0].sound_recordings[0]', 'type') in fields
+        assert ('releases[0].sound_recordings[1]', 'isrc') in fields
+        assert ('releases[0].sound_recordings[2]', 'isrc') in fields
+        assert ('releases[0].sound_recordings[2]', 'parental_warning_type') in fields
+        assert ('releases[0].sound_recordings[2]', 'file') in fields
+        assert ('releases[0].sender', 'party_id') in fields
+        assert ('releases[1]', 'image') in fields
+        assert ('releases[1]', 'sound_recordings') in fields
+        with pytest.raises(ValidationError):
+            report.raise_for_problems()
+
+    def test_malformed_input_is_reported_not_raised(self, release_description):
+        malformed = json.loads(json.dumps(release_description))
+        malformed['sender']['party_id'] = 5
+        malformed['sound_recordings'][0] = 5
+        malformed['sound_recordings'][1]['isrc'] = 12345
+        malformed['sound_recordings'][2]['file'] = ['a.wav']
+        keyed = dict(release_description, sound_recordings={'isrc': 'QZABC2300001'})
+        report = validate_releases([malformed, keyed, 5])
+        fields = {(problem.location, problem.field) for problem in report.problems}
+        assert fields == {('releases[0].sender', 'party_id'),
+                          ('releases[0].sound_recordings[0]', None),
+                          ('releases[0].sound_recordings[1]', 'isrc'),
+                          ('releases[0].sound_recordings[2]', 'file'),
+                          ('releases[1]', 'sound_recordings'),
+                          ('releases[2]', None)}
+
+
+class TestPartyRegistry:
+    def test_registry_interns_by_normalized_name_and_type(self):
+        registry = PartyRegistry()
+        first = registry.get(PartyType.artist.value, "Test Artist")
+        assert registry.get(PartyType.artist.value, "  test   ARTIST ") is first
+        assert registry.get(PartyType.contributor.value, "Test Artist") is not first
+        assert len(registry) == 2
+
+    def test_registry_writes_party_list(self):
+        registry = PartyRegistry()
+        for i in range(300):
+            registry.get(PartyType.artist.value, f"Test Artist {i % 3}")
+        root = registry.write()
+        assert root.tag == PartyListTags.root.value
+        assert len(root.findall(PartyListTags.party.value)) == 3
+
+    def test_sound_recording_points_to_party_list(self, technicaldetails_wav):
+        registry = PartyRegistry()
+        recordings = [
+                SoundRecording(
+                    type_=SoundRecordingType.musical_work_sound_recording.value,
+                    id_=f"ISRC{i}",
+                    song_name=f"Song {i}",
+                    artist_name="Test Artist",
+                    pline_text="2023 Record Label",
+                    parental_warning_type=ParentalWarningType.non_explicit.value,
+                    technical_details=technicaldetails_wav,
+                    party=[Party(PartyType.artist.value, "Test Artist")],
+                    contributor=[registry.get(PartyType.contributor.value, "Test Contributor")],
+                    party_registry=registry,
+                    )
+                for i in range(3)
+                ]
+        tags = [recording.write() for recording in recordings]
+        party_list = registry.write()
+        references = {party.findtext(PartyListTags.party_reference.value)
+                      for party in party_list}
+        assert len(references) == 2
+        for tag in tags:
+            assert tag.find(PartyListTags.party.value) is None
+            assert tag.findtext(f"{SoundRecordingTags.display_artist.value}/"
+                                f"{SoundRecordingTags.artist_party_reference.value}") in references
+            assert tag.findtext(f"{SoundRecordingTags.contributor.value}/"
+                                f"{SoundRecordingTags.contributor_party_reference.value}") in references
+
+
+class TestDeterministic:
+    def build(self, wav_file):
+        registry = PartyRegistry(deterministic=True)
+        details, = TechnicalDetails.from_files([wav_file], workers=1,
+                                               deterministic=True, sender_id="PAPI9012849")
+        recording = SoundRecording(
+                type_=SoundRecordingType.musical_work_sound_recording.value,
+                id_="QZ0002300001",
+                song_name="Song",
+                artist_name="Test Artist",
+                pline_text="2023 Record Label",
+                parental_warning_type=ParentalWarningType.non_explicit.value,
+                technical_details=details,
+                party=[registry.get(PartyType.artist.value, "Test Artist")],
+                contributor=[registry.get(PartyType.contributor.value, "Test Contributor")],
+                party_registry=registry,
+                deterministic=True,
+                )
+        body = et.tostring(recording.write()) + et.tostring(registry.write())
+        return body, recording.get_reference()
+
+    def test_identical_input_gives_identical_output(self, wav_file):
+        assert self.build(wav_file) == self.build(wav_file)
+
+    def test_content_id_depends_on_parts(self):
+        assert content_id('Party', 'a') == content_id('Party', 'a')
+        assert content_id('Party', 'a') != content_id('Party', 'b')
+        assert Party(PartyType.artist.value, "A B", True).id == Party(PartyType.artist.value, "a  b", True).id
+        assert Party(PartyType.artist.value, "A B").id != Party(PartyType.artist.value, "A B").id
+
+    def test_message_header(self, sender, receiver):
+        created = datetime(2023, 2, 10, 14, 26)
+
+        def header():
+            return et.tostring(MessageHeader(sender, receiver,
+                                             created_datetime=created,
+                                             deterministic=True).write())
+        assert header() == header()
+        assert b"2023-02-10T14:26:00" in header()
+
+
 class TestImage:
     def test_image_root_tag(self):
         logger.info("Testing root of Image is correct.")
@@ -1,56 +1,116 @@
+import atexit
+import hashlib
+import json
 import logging
 import os
-import sys
-from pathlib import Path
-
-file = Path(__file__).resolve()
-package_root_directory = file.parents[1]
-sys.path.append(str(package_root_directory))
+import queue
 
 from datetime import datetime
+from uuid import UUID, uuid5
 from lxml import etree as et
-from hashlib import md5
 
 #  local imports
-from pydex.config import LOG_DIR, TEST_XML_DIR
+from pydex.config import LOG_DIR, LOG_FILE, LOG_LEVEL, LOG_FORMAT, TEST_XML_DIR, ID_NAMESPACE
+from pydex.metrics import metrics
+from pydex.sinks import Sink
+
+#  Every module logs to a child of the package logger, which is the only
+#  place handlers and the level are set. Until configure_logging is called
+#  records below LOG_LEVEL are dropped by a cached level check and the rest
+#  go nowhere, so importing pydex never touches the filesystem.
+package_logger = logging.getLogger(__name__.rpartition('.')[0] or __name__)
+package_logger.setLevel(LOG_LEVEL)
+package_logger.addHandler(logging.NullHandler())
+log_listener = None
 
 
-def get_logger(name, logfile):
+def get_logger(name):
     """Return a logger object."""
-    path_to_log = os.path.join(LOG_DIR, logfile)
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    # create a file handler
-    handler = logging.FileHandler(f'{path_to_log}.log', mode='w')
-    handler.setLevel(logging.DEBUG)
-    # create a logging format
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s\n')
-    handler.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(handler)
-    return logger
+    return logging.getLogger(name)
+
+
+def configure_logging(level=LOG_LEVEL, logfile=LOG_FILE, handler=None):
+    """
+    Sets the level of every pydex logger and sends their records through a
+    QueueHandler to a QueueListener thread, which writes them to
+    LOG_DIR/logfile.log or to handler if one is given. Emitting a record
+    then never waits on file I/O. Calling it again replaces the previous setup.
+    """
+    global log_listener
+    #  Only imported once logging is configured, it pulls in socket.
+    from logging.handlers import QueueHandler, QueueListener
+    stop_logging()
+    if handler is None:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        handler = logging.FileHandler(os.path.join(LOG_DIR, f'{logfile}.log'))
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    package_logger.addHandler(QueueHandler(log_queue))
+    package_logger.setLevel(level)
+    log_listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    log_listener.start()
+    return log_listener
+
+
+@atexit.register
+def stop_logging():
+    """
+    Flush queued records, detach the handlers set up by configure_logging
+    and put the level back to LOG_LEVEL.
+    """
+    global log_listener
+    if log_listener is None:
+        return
+    from logging.handlers import QueueHandler
+    log_listener.stop()
+    for handler in log_listener.handlers:
+        handler.close()
+    for handler in package_logger.handlers[:]:
+        if isinstance(handler, QueueHandler):
+            package_logger.removeHandler(handler)
+    package_logger.setLevel(LOG_LEVEL)
+    log_listener = None
 
 
-logger = get_logger(__name__, 'tests')
+logger = get_logger(__name__)
+
+id_namespace = UUID(ID_NAMESPACE)
 
 
 def add_subelement_with_text(parent, tag, text, **attrib):
     """Add a subelement with text to parent element."""
-    logger.debug(f'Adding subelement {tag} with text {text} to parent {parent.tag}\n')
+    #  Called for every element of a message, so it deliberately does not log.
     element = et.SubElement(parent, tag, **attrib)
     element.text = text
 
 
-def save(root_element, output_filename):
+def save(root_element, output_filename, pretty_print=True, output_dir=TEST_XML_DIR, **kwargs):
+    """
+    Saves xml file atomically into output_dir. Other keyword arguments,
+    such as compression, are passed on to the Sink.
+    """
+    path_to_save = os.path.join(output_dir, output_filename)
+    logger.debug('Saving xml file to %s', path_to_save)
+    with metrics.span('save', file=path_to_save):
+        Sink(path_to_save, pretty_print=pretty_print, **kwargs).write(root_element)
+    metrics.incr('save.bytes', os.path.getsize(path_to_save), file=path_to_save)
+
+
+def content_id(*parts) -> str:
+    """
+    Return a uuid5 string derived from parts, used instead of uuid4 in
+    deterministic mode so that the same input always gets the same id.
+    """
+    return str(uuid5(id_namespace, '\x1f'.join(str(part) for part in parts)))
+
+
+def fingerprint(*parts) -> str:
     """
-    Saves xml file.
+    Return a sha256 hexdigest of parts, which must be JSON serializable.
+    Used to key cached fragments by the inputs they were built from.
     """
-    path_to_save = os.path.join(TEST_XML_DIR, output_filename)
-    logger.debug(f'Saving xml file to {path_to_save}\n')
-    tree = et.ElementTree(root_element)
-    logger.debug(f'Generating tree {tree}\n')
-    logger.debug(f'Writing tree to file {path_to_save}\n')
-    tree.write(path_to_save, pretty_print=True)
+    data = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
 
 
 def get_initials(full_name):
@@ -78,14 +138,3 @@ def format_duration(duration: int) -> str:
             m = f"0{m}"
         return f"PT{m}M{s}S"
 
-
-def compute_image_hash(image_file):
-    """
-    Computes image hash
-    """
-    logger.debug('Computing hash for image.')
-    with open(image_file, 'rb') as image_bytes:
-        hash_value = md5()
-        while chunk := image_bytes.read(9000):
-            hash_value.update(chunk)
-        return hash_value.hexdigest()